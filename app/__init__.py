@@ -1,62 +1,103 @@
 from flask import Flask
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
-import os
 from flask_mail import Mail
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
+from app.hashing import PasswordHasher
+from app.database import Database
+from app.search import SearchIndex
+from app.metrics import Metrics
+from app.log_pipeline import LogPipeline
+from app.compression import Compress
+from app.assets import Assets
+from app.templating import TemplateCache
+from app.migrate import Migrate
 
-#
-
-app = Flask(__name__) # our main application
-app.config.from_object(Config) # config class stores our app's configuration variables.
-db = SQLAlchemy(app) # SQL database
-migrate = Migrate(app, db) # object for updating the database
-login = LoginManager(app) # used for logging users in/out, password hashing, etc.
-login.login_view = 'login' #
-mail = Mail(app) # email support
-bootstrap = Bootstrap(app) # bootstrap CSS framework
-moment = Moment(app) # implements moment.js
-
-
-
-from app import routes, models, errors
-
-# Error handling
-if not app.debug:
-    """
-    Send emails to admins when a bug occurs on the sight.
-    """
-    if app.config['MAIL_SERVER']:
-        auth = None
-        if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
-            auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        secure = None
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-        mail_handler = SMTPHandler(
-            mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
-            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
-            toaddrs=app.config['ADMINS'], subject='Microblog Failure',
-            credentials=auth, secure=secure)
-
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
-    """
-    Log errors to a file.
-    """
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/microblog.log', maxBytes=10240,
-                                       backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-
-    app.logger.setLevel(logging.INFO)
-    app.logger.info('Microblog startup')
+"""
+The extensions are created here without an application and bound to one
+by create_app(). This keeps importing the package cheap and lets us build
+as many differently configured apps as we like (e.g. one per test).
+"""
+
+db = Database() # SQL database, engine tuned from the config
+login = LoginManager() # used for logging users in/out, password hashing, etc.
+login.login_view = 'auth.login' #
+login.blueprint_login_views = {'api': None} # the API answers 401 instead
+mail = Mail() # email support
+bootstrap = Bootstrap() # bootstrap CSS framework
+moment = Moment() # implements moment.js
+password_hasher = PasswordHasher() # runs password hashing in a process pool
+search_index = SearchIndex() # full-text index of post bodies
+metrics = Metrics() # per-request latency, SQL and template timings
+log_pipeline = LogPipeline() # queued JSON-lines file and error email logging
+compress = Compress() # gzip/brotli response compression
+assets = Assets() # hashed, precompressed Bootstrap/jQuery/moment.js files
+template_cache = TemplateCache() # on-disk compiled templates and warm-up
+migrate = Migrate() # 'flask db' migrations; alembic is imported on first use
+
+from app.firehose import RecentPosts
+recent_posts = RecentPosts() # newest posts of all users, for explore
+from app.last_seen import LastSeenBuffer
+last_seen = LastSeenBuffer() # batches User.last_seen writes
+from app.fragments import FragmentCache
+fragment_cache = FragmentCache() # rendered _post.html fragments
+from app.live import LiveHub
+live_hub = LiveHub() # server-sent new posts for open home pages
+
+
+def create_app(config_class=Config):
+    app = Flask(__name__) # our main application
+    app.config.from_object(config_class) # config class stores our app's configuration variables.
+
+    db.init_app(app)
+    login.init_app(app)
+    mail.init_app(app)
+    bootstrap.init_app(app)
+    moment.init_app(app)
+    password_hasher.init_app(app)
+    search_index.init_app(app)
+    metrics.init_app(app)
+    compress.init_app(app)
+    assets.init_app(app)
+    recent_posts.init_app(app)
+    last_seen.init_app(app)
+    fragment_cache.init_app(app)
+    live_hub.init_app(app)
+    from app.email import mail_queue
+    mail_queue.init_app(app)
+    from app.models import user_cache
+    user_cache.init_app(app)
+    migrate.init_app(app, db)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+    from app.auth import bp as auth_bp
+    app.register_blueprint(auth_bp)
+    from app.main import bp as main_bp
+    app.register_blueprint(main_bp)
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api')
+
+    # Error handling: log to logs/ and email admins about errors, from a
+    # background thread (see app/log_pipeline.py).
+    if not app.debug and not app.testing:
+        log_pipeline.init_app(app)
+        app.logger.setLevel(logging.INFO)
+        app.logger.info('Microblog startup')
+    metrics.counter('microblog_log_records_dropped_total',
+                    'Log records dropped because the log queue was full.',
+                    lambda: log_pipeline.dropped)
+    metrics.counter('microblog_error_emails_suppressed_total',
+                    'Error emails held back by the rate limit.',
+                    lambda: log_pipeline.emails_suppressed)
+    metrics.counter('microblog_live_events_dropped_total',
+                    'Live timeline events dropped because a subscriber\'s '
+                    'queue was full.', lambda: live_hub.dropped)
+
+    # last, so that every template folder is known for the warm-up
+    template_cache.init_app(app)
+    return app
+
+from app import models
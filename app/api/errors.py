@@ -0,0 +1,23 @@
+from flask import jsonify
+from werkzeug.http import HTTP_STATUS_CODES
+from app.api import bp
+
+"""
+API errors are returned as JSON instead of the HTML error pages.
+"""
+
+def error_response(status_code, message=None):
+    payload = {'error': HTTP_STATUS_CODES.get(status_code, 'Unknown error')}
+    if message:
+        payload['message'] = message
+    response = jsonify(payload)
+    response.status_code = status_code
+    return response
+
+@bp.errorhandler(401)
+def unauthorized_error(error):
+    return error_response(401, 'Login required.')
+
+@bp.errorhandler(404)
+def not_found_error(error):
+    return error_response(404)
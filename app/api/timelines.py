@@ -0,0 +1,139 @@
+import json
+from flask import Response, current_app, jsonify, request, stream_with_context, \
+    url_for
+from flask_login import current_user, login_required
+from app import recent_posts
+from app.api import bp
+from app.models import User, Post, timeline, avatar_url
+from app.pagination import paginate_keyset
+
+"""
+JSON versions of the home, explore and user timelines.
+
+The paged endpoints take the same 'before'/'after' cursors as the HTML
+pages plus a 'limit' (at most 100) and return
+{'items': [...], '_links': {'self', 'next', 'prev'}}.
+
+The '.ndjson' endpoints stream the whole timeline, one post per line.
+Rows are fetched in batches of STREAM_BATCH with yield_per(), which also
+asks the driver for a server-side cursor where it has one, and are
+written out as they arrive, so memory use doesn't grow with the number
+of posts.
+
+Both select plain column tuples from the timeline queries instead of
+loading Post and User objects.
+"""
+
+STREAM_BATCH = 500
+
+
+def post_columns(query):
+    """
+    Narrow a Post query (e.g. followed_posts() or user.posts) down to the
+    columns that to_dict() needs.
+    """
+    return query.join(User, User.id == Post.user_id).with_entities(
+        Post.id, Post.body, Post.timestamp, User.id.label('author_id'),
+        User.username, User.avatar_hash)
+
+
+def to_dict(id, body, timestamp, author_id, username, avatar_hash):
+    return {
+        'id': id,
+        'body': body,
+        'timestamp': timestamp.isoformat() + 'Z',
+        'author': {
+            'id': author_id,
+            'username': username,
+            'avatar': avatar_url(avatar_hash, 36),
+        },
+    }
+
+
+def page_arguments():
+    limit = min(request.args.get('limit', current_app.config['POSTS_PER_PAGE'],
+                                 type=int), 100)
+    return max(limit, 1), request.args.get('before'), request.args.get('after')
+
+
+def collection(items, page, endpoint, **kwargs):
+    limit = request.args.get('limit', type=int)
+    return jsonify({
+        'items': items,
+        '_links': {
+            'self': url_for(endpoint, limit=limit, before=request.args.get(
+                'before'), after=request.args.get('after'), **kwargs),
+            'next': url_for(endpoint, limit=limit, before=page.next_cursor,
+                            **kwargs) if page.has_next else None,
+            'prev': url_for(endpoint, limit=limit, after=page.prev_cursor,
+                            **kwargs) if page.has_prev else None,
+        },
+    })
+
+
+def stream(query):
+    def generate():
+        for row in query.yield_per(STREAM_BATCH):
+            yield json.dumps(to_dict(*row)) + '\n'
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@bp.route('/timeline/home')
+@login_required
+def home_timeline():
+    limit, before, after = page_arguments()
+    page = paginate_keyset(post_columns(current_user.followed_posts()),
+                           timeline.c.timestamp, timeline.c.post_id,
+                           limit, before=before, after=after)
+    return collection([to_dict(*row) for row in page.items], page,
+                      'api.home_timeline')
+
+
+@bp.route('/timeline/home.ndjson')
+@login_required
+def home_timeline_stream():
+    return stream(post_columns(current_user.followed_posts()))
+
+
+@bp.route('/timeline/explore')
+@login_required
+def explore_timeline():
+    limit, before, after = page_arguments()
+    # the newest pages come from the in-memory firehose, like /explore
+    page = recent_posts.page(limit, before, after)
+    if page is not None:
+        items = [to_dict(p.id, p.body, p.timestamp, p.author.id,
+                         p.author.username, p.author.avatar_hash)
+                 for p in page.items]
+    else:
+        page = paginate_keyset(post_columns(Post.query), Post.timestamp,
+                               Post.id, limit, before=before, after=after)
+        items = [to_dict(*row) for row in page.items]
+    return collection(items, page, 'api.explore_timeline')
+
+
+@bp.route('/timeline/explore.ndjson')
+@login_required
+def explore_timeline_stream():
+    return stream(post_columns(Post.query).order_by(
+        Post.timestamp.desc(), Post.id.desc()))
+
+
+@bp.route('/users/<username>/posts')
+@login_required
+def user_timeline(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    limit, before, after = page_arguments()
+    page = paginate_keyset(post_columns(user.posts), Post.timestamp, Post.id,
+                           limit, before=before, after=after)
+    return collection([to_dict(*row) for row in page.items], page,
+                      'api.user_timeline', username=user.username)
+
+
+@bp.route('/users/<username>/posts.ndjson')
+@login_required
+def user_timeline_stream(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return stream(post_columns(user.posts).order_by(
+        Post.timestamp.desc(), Post.id.desc()))
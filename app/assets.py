@@ -0,0 +1,176 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import zlib
+from flask import Response, abort, request, url_for
+import flask_bootstrap
+from app.compression import brotli
+
+"""
+Static assets served from this process, with content-hashed names.
+
+The Bootstrap, jQuery and glyphicon files come from the copies that ship
+with Flask-Bootstrap. Files in the app's static folder are added (and
+take precedence), e.g. moment.min.js: the CDNs aren't reachable from
+every deployment, so base.html only falls back to the moment.js CDN when
+there is no local copy.
+
+At startup every file is read once. Its name gets the first 12 hex
+digits of its SHA-256 (css/bootstrap.min.css becomes
+css/bootstrap.min.<hash>.css), and gzip and brotli variants are built
+at the highest settings. url()s in stylesheets are rewritten to the
+hashed names of the files they point to, before the stylesheet itself
+is hashed. Built assets are kept per process, so creating another app
+(e.g. in the tests) doesn't compress them again.
+
+Requests for '/assets/<hashed name>' are served from memory, in the best
+encoding the client accepts. They carry 'Cache-Control: immutable' with
+a max-age of ASSETS_MAX_AGE: a changed file gets a new name, so a cached
+copy never needs to be checked again. Templates get the URLs from
+asset_url('css/bootstrap.min.css').
+"""
+
+# files that aren't worth shipping to browsers
+SKIPPED = ('.map', '.md', '.txt')
+URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+class Asset(object):
+
+    def __init__(self, name, data, digest):
+        self.mimetype = mimetypes.guess_type(name)[0] or \
+            'application/octet-stream'
+        root, ext = posixpath.splitext(name)
+        self.hashed_name = '{}.{}{}'.format(root, digest, ext)
+        self.etag = digest
+        self.variants = {None: data}
+        compressed = zlib.compressobj(9, zlib.DEFLATED, 31)
+        self._keep('gzip', compressed.compress(data) + compressed.flush())
+        if brotli is not None:
+            self._keep('br', brotli.compress(data, quality=11))
+
+    def _keep(self, encoding, data):
+        # only when it pays off, e.g. not for the already compressed woff2
+        if len(data) < len(self.variants[None]) * 0.9:
+            self.variants[encoding] = data
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        self.assets = {} # hashed name -> Asset
+        self.names = {} # name -> hashed name
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_age = app.config['ASSETS_MAX_AGE']
+        bootstrap = os.path.join(os.path.dirname(flask_bootstrap.__file__),
+                                 'static')
+        files = _collect(bootstrap)
+        if app.static_folder and os.path.isdir(app.static_folder):
+            files.update(_collect(app.static_folder))
+        self.build(files)
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.add_template_global(self.url, 'asset_url')
+
+    def build(self, files):
+        """
+        Hash and compress files, a dict of name -> path. Stylesheets go
+        last, so that the files they refer to already have their names.
+        """
+        assets = {}
+        names = {}
+        for name in sorted(files, key=lambda name: (name.endswith('.css'),
+                                                    name)):
+            with open(files[name], 'rb') as f:
+                data = f.read()
+            if name.endswith('.css'):
+                data = self._rewrite_urls(name, data, names)
+            asset = _asset(name, data)
+            assets[asset.hashed_name] = asset
+            names[name] = asset.hashed_name
+        self.assets, self.names = assets, names
+
+    def _rewrite_urls(self, name, data, names):
+        def replace(match):
+            url = match.group(2)
+            path = re.split(r'[?#]', url, 1)[0]
+            target = posixpath.normpath(posixpath.join(
+                posixpath.dirname(name), path))
+            if target not in names:
+                return match.group(0)
+            # relative, like the original: the hashed names keep their
+            # directories
+            return 'url({}{})'.format(posixpath.relpath(
+                names[target], posixpath.dirname(name)), url[len(path):])
+        return URL_RE.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+    def url(self, name):
+        """
+        The URL of the asset called name (e.g. 'js/bootstrap.min.js'), or
+        None if there is no such file.
+        """
+        hashed_name = self.names.get(name)
+        if hashed_name is None:
+            return None
+        return url_for('assets', filename=hashed_name)
+
+    def serve(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and \
+                    request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        etag = asset.etag + ('-' + encoding if encoding else '')
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(asset.variants[encoding],
+                                mimetype=asset.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.cache_control.immutable = True
+        return response
+
+
+# every asset built by this process, by name and content: tests and
+# benchmarks create many apps, but each file is only compressed once.
+_built = {}
+
+def _asset(name, data):
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    asset = _built.get((name, digest))
+    if asset is None:
+        asset = _built[(name, digest)] = Asset(name, data, digest)
+    return asset
+
+
+def _collect(directory):
+    """
+    name (a relative path with '/') -> path of every file under directory.
+    Where there is a minified copy, the full one is left out.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(SKIPPED) or filename.startswith('.'):
+                continue
+            base, ext = os.path.splitext(filename)
+            if not base.endswith('.min') and \
+                    base + '.min' + ext in filenames:
+                continue
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, directory).replace(os.sep, '/')
+            files[name] = path
+    return files
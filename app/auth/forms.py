@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, PasswordField, BooleanField, SubmitField
-from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
+from wtforms import StringField, PasswordField, BooleanField, SubmitField
+from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
 from app.models import User
 
 class LoginForm(FlaskForm):
@@ -38,26 +38,6 @@ class RegistrationForm(FlaskForm):
         if user is not None:
             raise ValidationError('Please Use a Different Email')
 
-class EditProfileForm(FlaskForm):
-    """
-    Form for editing user's profile.
-    Right now users can change their username and add an 'about me' section
-    to their profile.
-    """
-    username = StringField('Username', validators=[DataRequired()])
-    about_me = TextAreaField('About me', validators=[Length(min=0, max=140)])
-    submit = SubmitField('Submit')
-
-    def __init__(self, original_username, *args, **kwargs):
-        super(EditProfileForm, self).__init__(*args, **kwargs)
-        self.original_username = original_username
-
-    def validate_username(self, username):
-        if username.data != self.original_username:
-            user = User.query.filter_by(username=self.username.data).first()
-            if user is not None:
-                raise ValidationError('Please use a different username.')
-
 class ResetPasswordRequestForm(FlaskForm):
     """
     Form for sending a reset email request.
@@ -73,13 +53,3 @@ class ResetPasswordForm(FlaskForm):
     password2 = PasswordField(
         'Repeat Password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Request Password Reset')
-
-class EmptyForm(FlaskForm):
-    """
-    This is a button a user clicks to either follow or unfollow another user.
-    """
-    submit = SubmitField('Submit')
-
-class PostForm(FlaskForm):
-    post = TextAreaField('Say something', validators=[DataRequired(), Length(min=1,max=140)])
-    submit = SubmitField('Submit')
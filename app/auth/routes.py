@@ -0,0 +1,92 @@
+from flask import render_template, flash, redirect, url_for, request
+from app import db
+from app.auth.forms import LoginForm, RegistrationForm, ResetPasswordRequestForm, ResetPasswordForm
+from app.auth.email import send_password_reset_email
+from flask_login import current_user, login_user, logout_user
+from app.models import User, user_cache
+from werkzeug.urls import url_parse
+from app.auth import bp
+
+'''
+View functions for signing in and out, registering and resetting
+passwords.
+'''
+
+
+# login page
+@bp.route('/login', methods=['GET','POST'])
+def login():
+	if current_user.is_authenticated:
+		return redirect(url_for('main.index'))
+	form = LoginForm()
+	if form.validate_on_submit():
+		user = User.query.filter_by(username=form.username.data).first()
+		if user is None or not user.check_password(form.password.data):
+			flash('Invalid username or password.')
+			return redirect(url_for('auth.login'))
+		login_user(user, remember=form.remember_me.data)
+		db.session.commit() # saves a hash upgraded by check_password()
+		user_cache.invalidate(user.id)
+		next_page = request.args.get('next')
+		if not next_page or url_parse(next_page).netloc != '':
+			'''
+			note: the above second conditional ensures that all
+			url's are relative (no outside agent can slip in a url path).
+			'''
+			next_page = url_for('main.index')
+		return redirect(next_page)
+	return render_template('login.html', title='Sign In', form=form)
+
+# log out and return to home page
+@bp.route('/logout')
+def logout():
+	logout_user()
+	return redirect(url_for('main.index'))
+
+# register new user page
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+		# user is already authenticated. return to index page.
+        return redirect(url_for('main.index'))
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        user = User(username=form.username.data, email=form.email.data)
+        user.set_password(form.password.data)
+        db.session.add(user)
+        db.session.commit()
+        flash('Congratulations, you are now a registered user!')
+        return redirect(url_for('auth.login'))
+    return render_template('register.html', title='Register', form=form)
+
+# reset password request page
+@bp.route('/reset_password_request', methods=['GET', 'POST'])
+def reset_password_request():
+	if current_user.is_authenticated:
+		return redirect(url_for('main.index'))
+	form = ResetPasswordRequestForm()
+	if form.validate_on_submit():
+		user = User.query.filter_by(email=form.email.data).first()
+		if user:
+			send_password_reset_email(user)
+		flash('Check your email for the instructions to reset your password')
+		return redirect(url_for('auth.login'))
+	return render_template('reset_password_request.html',
+                           title='Reset Password', form=form)
+
+# reset password page
+@bp.route('/reset_password/<token>', methods=['GET', 'POST'])
+def reset_password(token):
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    user = User.verify_reset_password_token(token)
+    if not user:
+        return redirect(url_for('main.index'))
+    form = ResetPasswordForm()
+    if form.validate_on_submit():
+        user.set_password(form.password.data)
+        db.session.commit()
+        user_cache.invalidate(user.id)
+        flash('Your password has been reset.')
+        return redirect(url_for('auth.login'))
+    return render_template('reset_password.html', form=form)
@@ -0,0 +1,131 @@
+import json
+from datetime import datetime
+from time import perf_counter
+from sqlalchemy import DateTime
+from app import db
+from app.models import User, Post, followers
+
+"""
+Bulk NDJSON export and import, used by 'flask data export/import'.
+
+Every table is written to its own file, one JSON object per row with the
+table's columns as keys. Import goes around the ORM: rows are inserted
+with executemany() in chunks of chunk_size, committing after each chunk,
+with autoflush off. Mapper events such as timeline fan-out and search
+indexing don't fire for these inserts, so the caller rebuilds that
+derived data afterwards.
+
+Rows keep their exported ids. SQLite and MySQL carry on after the largest
+id by themselves, but PostgreSQL's id sequences don't see explicit ids,
+so after each table its sequence is moved past them (setval). Other
+databases with sequences are refused before anything is inserted.
+"""
+
+# in dependency order: posts and follow edges point at users
+TABLES = [('users', User.__table__), ('posts', Post.__table__),
+          ('followers', followers)]
+FETCH_SIZE = 1000
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_table(table, out):
+    """
+    Write every row of table to the text file out. Rows are streamed from
+    the database in FETCH_SIZE batches. Returns the number of rows.
+    """
+    columns = [column.name for column in table.columns]
+    result = db.session.connection().execution_options(
+        stream_results=True).execute(table.select().order_by(
+        *table.primary_key.columns))
+    count = 0
+    while True:
+        rows = result.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, map(_encode, row)))))
+            out.write('\n')
+        count += len(rows)
+    return count
+
+
+def import_table(table, lines, chunk_size=10000, progress=None):
+    """
+    Insert the NDJSON rows in lines (e.g. an open file) into table.
+    progress(rows, seconds) is called after each committed chunk.
+    Returns the number of rows inserted.
+    """
+    dialect = db.session.get_bind().dialect
+    if dialect.supports_sequences and dialect.name != 'postgresql':
+        raise NotImplementedError(
+            "Can't import into {}: its id sequences wouldn't be reset".format(
+                dialect.name))
+    dates = [column.name for column in table.columns
+             if isinstance(column.type, DateTime)]
+    def rows():
+        for line in lines:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            for name in dates:
+                if row.get(name) is not None:
+                    row[name] = datetime.fromisoformat(row[name])
+            yield row
+    count = insert_rows(table, rows(), chunk_size, progress)
+    reset = sequence_reset(table, dialect)
+    if reset is not None:
+        db.session.execute(reset)
+        db.session.commit()
+    return count
+
+
+def sequence_reset(table, dialect):
+    """
+    A statement that moves the id sequence of table past its largest id,
+    or None if the dialect (or the table) has no sequence to move.
+    """
+    columns = list(table.primary_key.columns)
+    if dialect.name != 'postgresql' or len(columns) != 1:
+        return None
+    column = columns[0]
+    # setval(..., false): the next id handed out is max(id) + 1
+    return db.select([db.func.setval(
+        db.func.pg_get_serial_sequence(
+            dialect.identifier_preparer.format_table(table), column.name),
+        db.func.coalesce(db.func.max(column), 0) + 1, False)])
+
+
+def insert_rows(table, rows, chunk_size=10000, progress=None):
+    """
+    Insert an iterable of row dicts into table, chunk_size rows per
+    executemany() and transaction. Every row must have the same keys.
+    Returns the number of rows inserted.
+    """
+    insert = table.insert()
+    start = perf_counter()
+    count = 0
+    chunk = []
+    with db.session.no_autoflush:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                count += _insert_chunk(insert, chunk)
+                chunk = []
+                if progress is not None:
+                    progress(count, perf_counter() - start)
+        if chunk:
+            count += _insert_chunk(insert, chunk)
+            if progress is not None:
+                progress(count, perf_counter() - start)
+    return count
+
+
+def _insert_chunk(insert, chunk):
+    db.session.execute(insert, chunk)
+    db.session.commit()
+    return len(chunk)
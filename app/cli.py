@@ -0,0 +1,112 @@
+import os
+import click
+from app import db, search_index
+from app.models import rebuild_timelines, repair_counters
+from app.bulk import TABLES, export_table, import_table
+
+"""
+Custom 'flask' commands. These are registered on the app in driver.py,
+so they are available as e.g. 'flask timeline rebuild'.
+"""
+
+def register(app):
+
+    @app.cli.group()
+    def timeline():
+        """Materialized home timeline commands."""
+        pass
+
+    @timeline.command()
+    def rebuild():
+        """Rebuild every user's home timeline from posts and followers."""
+        rows = rebuild_timelines()
+        click.echo('Rebuilt timelines: {} rows.'.format(rows))
+
+    @app.cli.group()
+    def counters():
+        """Denormalized follower/following/post counter commands."""
+        pass
+
+    @counters.command()
+    def repair():
+        """Recompute every user's follower, following and post counts."""
+        users = repair_counters()
+        click.echo('Repaired counters for {} users.'.format(users))
+
+    @app.cli.group()
+    def search():
+        """Full-text post search commands."""
+        pass
+
+    @search.command()
+    def reindex():
+        """Rebuild the search index from all existing posts."""
+        posts = search_index.reindex(db.session.connection())
+        db.session.commit()
+        click.echo('Indexed {} posts.'.format(posts))
+
+    @app.cli.group()
+    def suggestions():
+        """Precomputed "who to follow" suggestion commands."""
+        pass
+
+    @suggestions.command()
+    @click.option('--full', is_flag=True,
+                  help='Recompute every user, not only those whose '
+                       'neighbourhood changed.')
+    def compute(full):
+        """Recompute the "who to follow" suggestions."""
+        # imported here: SciPy adds a quarter of a second to every start
+        # of the app (driver.py imports this module)
+        from app.suggestions import compute_suggestions
+        def progress(users, seconds):
+            click.echo('\r{} users, {:.1f}s'.format(users, seconds), nl=False)
+        stats = compute_suggestions(app.config['SUGGESTIONS_PER_USER'], full,
+                                    progress)
+        if stats['computed']:
+            click.echo('')
+        click.echo('Computed suggestions for {computed} of {users} users '
+                   '({follows} follows): {suggestions} suggestions in '
+                   '{seconds:.2f}s, {load_seconds:.2f}s of it loading the '
+                   'graph.'.format(**stats))
+
+    @app.cli.group()
+    def data():
+        """Bulk NDJSON export and import of users, posts and follows."""
+        pass
+
+    @data.command('export')
+    @click.argument('directory')
+    def export_data(directory):
+        """Write users, posts and followers to DIRECTORY/<table>.ndjson."""
+        os.makedirs(directory, exist_ok=True)
+        for name, table in TABLES:
+            with open(os.path.join(directory, name + '.ndjson'), 'w') as out:
+                rows = export_table(table, out)
+            click.echo('{}: {} rows'.format(name, rows))
+
+    @data.command('import')
+    @click.argument('directory')
+    @click.option('--chunk-size', default=10000, show_default=True,
+                  help='Rows per executemany() and per transaction.')
+    def import_data(directory, chunk_size):
+        """
+        Load DIRECTORY/<table>.ndjson into an empty database, then rebuild
+        timelines, counters and the search index.
+        """
+        for name, table in TABLES:
+            path = os.path.join(directory, name + '.ndjson')
+            if not os.path.exists(path):
+                click.echo('{}: no {}, skipped'.format(name, path))
+                continue
+            def progress(rows, seconds):
+                click.echo('\r{}: {} rows, {:.0f} rows/s'.format(
+                    name, rows, rows / seconds if seconds else 0), nl=False)
+            with open(path) as lines:
+                import_table(table, lines, chunk_size, progress)
+            click.echo('')
+        click.echo('Rebuilt timelines: {} rows.'.format(rebuild_timelines()))
+        click.echo('Repaired counters for {} users.'.format(repair_counters()))
+        posts = search_index.reindex(db.session.connection())
+        db.session.commit()
+        click.echo('Indexed {} posts.'.format(posts))
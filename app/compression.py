@@ -0,0 +1,134 @@
+import zlib
+from flask import request
+try:
+    import brotli
+except ImportError: # optional; without it we only offer gzip
+    brotli = None
+
+"""
+gzip/brotli compression of responses.
+
+Text responses (HTML, JSON, NDJSON, event streams, ...) are compressed
+when the client accepts it, preferring brotli if the 'brotli' package is
+installed. Whole responses smaller than COMPRESS_MIN_SIZE bytes are sent
+as they are, since compressing them gains nothing.
+
+Streamed responses (the NDJSON timelines, the live event stream) are
+compressed as they are sent, without buffering them. For event streams,
+every chunk is flushed through the compressor, so each event reaches the
+client at once. Other streams are flushed when the compressor has a
+block ready.
+
+Responses that are already encoded, such as the precompressed static
+assets (see app/assets.py), and files sent with send_file are passed
+through. The ETag of a compressed response is made weak, because the
+bytes differ from those of the uncompressed page. The conditional GET
+validators compare weakly (see app/conditional.py), so 304s still work.
+"""
+
+class Compress(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['COMPRESS_ENABLED']:
+            return
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        app.after_request(self.after_request)
+
+    def encoding(self):
+        """The encoding to use for the current request, or None."""
+        accept = request.accept_encodings
+        if brotli is not None and accept['br']:
+            return 'br'
+        if accept['gzip']:
+            return 'gzip'
+        return None
+
+    def compressor(self, encoding):
+        """
+        An object with compress(data) and flush(sync) methods for the
+        given encoding.
+        """
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.level)
+
+    def after_request(self, response):
+        if response.mimetype not in self.mimetypes or \
+                response.direct_passthrough or \
+                'Content-Encoding' in response.headers or \
+                response.status_code in (204, 304) or request.method == 'HEAD':
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.encoding()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self.stream(
+                response.response, response.charset,
+                self.compressor(encoding),
+                response.mimetype == 'text/event-stream')
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressor = self.compressor(encoding)
+            response.set_data(compressor.compress(data) +
+                              compressor.flush(False))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stream(self, chunks, charset, compressor, flush_every_chunk):
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(charset)
+                data = compressor.compress(chunk)
+                if flush_every_chunk:
+                    data += compressor.flush(True)
+                if data:
+                    yield data
+            yield compressor.flush(False)
+        finally:
+            # closing the original body runs its cleanup (e.g. the live
+            # stream unsubscribing)
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+
+class _GzipCompressor(object):
+
+    def __init__(self, level):
+        # wbits 31: a deflate stream in a gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self, sync):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH if sync else
+                                      zlib.Z_FINISH)
+
+
+class _BrotliCompressor(object):
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, sync):
+        return self._compressor.flush() if sync else \
+            self._compressor.finish()
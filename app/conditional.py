@@ -0,0 +1,69 @@
+from hashlib import md5
+from time import time
+from flask import request, session, current_app, make_response
+from flask_login import current_user
+
+"""
+Conditional GET support for the timeline and profile pages.
+
+A view builds a Validator from a few cheap values that change whenever the
+page would change (e.g. the newest post in the feed and the follow-graph
+version). If the client already holds a page with the same validator, it
+gets a 304 Not Modified and we skip the page queries and the template.
+
+ex.
+    validator = Validator(newest_post_id, last_modified=newest_timestamp)
+    if validator.is_current():
+        return validator.not_modified()
+    return validator.apply(make_response(render_template(...)))
+"""
+
+class Validator(object):
+
+    def __init__(self, *parts, last_modified=None):
+        # every page also depends on who is looking at it, on the query
+        # string (the page cursor) and on the CSRF token of its forms,
+        # which Flask-WTF expires after WTF_CSRF_TIME_LIMIT seconds.
+        time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 0
+        csrf_epoch = int(time() // max(time_limit // 2, 1)) if time_limit \
+            else 0
+        parts = parts + (current_user.get_id(), current_user.username,
+                         request.full_path, session.get('csrf_token'),
+                         csrf_epoch)
+        self.etag = md5('|'.join(str(part) for part in parts).encode(
+            'utf-8')).hexdigest()
+        self.last_modified = last_modified.replace(microsecond=0) \
+            if last_modified else None
+        # a page carrying flashed messages must always be rendered.
+        self.enabled = request.method == 'GET' and '_flashes' not in session
+
+    def is_current(self):
+        """
+        True if the client's copy of the page is still current.
+        """
+        if not self.enabled:
+            return False
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since and self.last_modified:
+            return self.last_modified <= \
+                request.if_modified_since.replace(tzinfo=None)
+        return False
+
+    def not_modified(self):
+        """
+        An empty 304 Not Modified response carrying the validator.
+        """
+        return self.apply(make_response('', 304))
+
+    def apply(self, response):
+        """
+        Attach the validator to a response.
+        """
+        if self.enabled:
+            response.set_etag(self.etag, weak=True)
+            if self.last_modified:
+                response.last_modified = self.last_modified
+            # browsers may keep the page, but must revalidate it each time.
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
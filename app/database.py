@@ -0,0 +1,156 @@
+import random
+from time import time
+from flask import has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+from sqlalchemy.sql.dml import UpdateBase
+
+"""
+Flask-SQLAlchemy with an engine profile taken from the app's config.
+
+SQLite files get the SQLITE_* pragmas from the config applied to every new
+connection. The important one is journal_mode=WAL: readers then work from
+a snapshot and are no longer blocked while posts, follows or last_seen
+updates are being written. busy_timeout makes writers wait for each other
+instead of failing with 'database is locked'.
+
+The pool is sized from DATABASE_POOL_SIZE and DATABASE_POOL_OVERFLOW for
+every backend; a size of 0 means NullPool (a new connection per checkout,
+Flask-SQLAlchemy's default for SQLite files). In-memory SQLite always uses
+a single StaticPool connection, as the data would be lost otherwise.
+Anything set explicitly in SQLALCHEMY_ENGINE_OPTIONS still wins.
+
+Read replicas listed in SQLALCHEMY_REPLICAS become the binds 'replica0',
+'replica1', ... and RoutingSession sends reads made while handling a GET
+(or HEAD) request to one of them. Everything else stays on the primary:
+flushes and INSERT/UPDATE/DELETE statements, non-GET requests, and work
+outside of requests (CLI commands, background threads). After a request
+commits a write, the client's next REPLICA_READ_YOUR_WRITES seconds of
+reads go to the primary too, so users see their own changes before the
+replicas catch up.
+"""
+
+# private engine option, consumed by create_engine() below
+PRAGMAS_OPTION = '_sqlite_pragmas'
+# key in the flask session holding the end of the read-your-writes window
+PRIMARY_UNTIL_KEY = '_primary_until'
+
+
+def sqlite_pragmas(config):
+    """
+    The (name, value) pragmas to run on each new SQLite connection.
+    Settings that are None are left at SQLite's default.
+    """
+    pragmas = [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT'])]
+    return [(name, value) for name, value in pragmas if value is not None]
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self.db = db
+        self._replica = None
+        self._wrote = False
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self._wrote = True
+        elif self.use_replica():
+            if self._replica is None:
+                # stick to one replica for the lifetime of the session
+                self._replica = random.choice(self.db.replica_binds(self.app))
+            return self.db.get_engine(self.app, self._replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def use_replica(self):
+        if not self.db.replica_binds(self.app) or not has_request_context():
+            return False
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        return session.get(PRIMARY_UNTIL_KEY, 0) < time()
+
+    def commit(self):
+        SignallingSession.commit(self)
+        if self._wrote:
+            self._wrote = False
+            window = self.app.config['REPLICA_READ_YOUR_WRITES']
+            if self.db.replica_binds(self.app) and has_request_context():
+                session[PRIMARY_UNTIL_KEY] = time() + window
+
+    def rollback(self):
+        SignallingSession.rollback(self)
+        self._wrote = False
+
+
+class Database(SQLAlchemy):
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICAS', [])
+        app.config.setdefault('REPLICA_READ_YOUR_WRITES', 5)
+        if app.config['SQLALCHEMY_REPLICAS']:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            for i, uri in enumerate(app.config['SQLALCHEMY_REPLICAS']):
+                binds['replica%d' % i] = uri
+            app.config['SQLALCHEMY_BINDS'] = binds
+        app.config.setdefault('DATABASE_POOL_SIZE', 0)
+        app.config.setdefault('DATABASE_POOL_OVERFLOW', 10)
+        app.config.setdefault('DATABASE_POOL_RECYCLE', 3600)
+        app.config.setdefault('SQLITE_JOURNAL_MODE', None)
+        app.config.setdefault('SQLITE_SYNCHRONOUS', None)
+        app.config.setdefault('SQLITE_CACHE_SIZE', None)
+        app.config.setdefault('SQLITE_MMAP_SIZE', None)
+        app.config.setdefault('SQLITE_BUSY_TIMEOUT', None)
+        super(Database, self).init_app(app)
+
+    def replica_binds(self, app):
+        return ['replica%d' % i
+                for i in range(len(app.config['SQLALCHEMY_REPLICAS']))]
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super(Database, self).apply_driver_hacks(
+            app, sa_url, options)
+        size = app.config['DATABASE_POOL_SIZE']
+        if sa_url.drivername.startswith('sqlite'):
+            options[PRAGMAS_OPTION] = sqlite_pragmas(app.config)
+            if options.get('poolclass') is StaticPool:
+                return sa_url, options # in-memory database
+            if size:
+                options['poolclass'] = QueuePool
+                options['pool_size'] = size
+                options['max_overflow'] = app.config['DATABASE_POOL_OVERFLOW']
+                # pooled connections are handed from thread to thread, but
+                # only ever used by one of them at a time.
+                options.setdefault('connect_args', {})
+                options['connect_args']['check_same_thread'] = False
+            else:
+                options['poolclass'] = NullPool
+        elif size:
+            options['pool_size'] = size
+            options['max_overflow'] = app.config['DATABASE_POOL_OVERFLOW']
+            options['pool_recycle'] = app.config['DATABASE_POOL_RECYCLE']
+            options['pool_pre_ping'] = True
+        else:
+            options['poolclass'] = NullPool
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop(PRAGMAS_OPTION, None)
+        engine = super(Database, self).create_engine(sa_url, engine_opts)
+        if pragmas:
+            @event.listens_for(engine, 'connect')
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas:
+                    cursor.execute('PRAGMA {} = {}'.format(name, value))
+                cursor.close()
+        return engine
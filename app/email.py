@@ -1,29 +1,139 @@
+import atexit
+from queue import Queue, Empty, Full
 from flask_mail import Message
-from app import mail, app
-from flask import render_template
-from threading import Thread
+from app import mail
+from threading import Thread, Lock
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+_STOP = object() # tells a worker thread to exit
+
+class MailQueue(object):
+    """
+    A bounded queue of outgoing messages, sent by a fixed pool of worker
+    threads instead of one thread per message.
+
+    Each worker takes up to MAIL_BATCH_SIZE queued messages at a time and
+    sends them all over a single SMTP connection (mail.connect()), so a
+    burst of password resets doesn't turn into a burst of connections.
+    When the queue is full, put() waits up to MAIL_QUEUE_TIMEOUT seconds
+    and then drops the message, logging it and counting it in 'dropped'.
+    Queued messages are drained when the process exits.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._threads = []
+        self._lock = Lock()
+        atexit.register(self.shutdown)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown() # workers of a previous app serve its old queue
+        self.app = app
+        self.workers = app.config['MAIL_WORKERS']
+        self.batch_size = app.config['MAIL_BATCH_SIZE']
+        self.timeout = app.config['MAIL_QUEUE_TIMEOUT']
+        self._queue = Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+
+    def put(self, msg):
+        """
+        Queue a message. Returns False if it had to be dropped.
+        """
+        self._start()
+        try:
+            self._queue.put(msg, timeout=self.timeout)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            self.app.logger.warning(
+                'Mail queue full, dropped message to %s (%d dropped so far)',
+                ', '.join(msg.recipients), dropped)
+            return False
+        return True
+
+    def _start(self):
+        # the worker threads are only started once there is mail to send.
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = Thread(target=self._work, name='mail-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            msg = self._queue.get()
+            if msg is _STOP:
+                return
+            batch = [msg]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    msg = self._queue.get_nowait()
+                except Empty:
+                    break
+                if msg is _STOP:
+                    stop = True
+                    break
+                batch.append(msg)
+            self._send(batch)
+            if stop:
+                return
+
+    def _send(self, batch):
+        # each message is sent (or fails) on its own; only messages that
+        # were never tried are lost with the connection.
+        tried = 0
+        with self.app.app_context():
+            try:
+                with mail.connect() as conn:
+                    for msg in batch:
+                        tried += 1
+                        try:
+                            conn.send(msg)
+                        except Exception:
+                            with self._lock:
+                                self.failed += 1
+                            self.app.logger.exception(
+                                'Failed to send an email to %s',
+                                ', '.join(msg.recipients))
+                        else:
+                            with self._lock:
+                                self.sent += 1
+            except Exception:
+                with self._lock:
+                    self.failed += len(batch) - tried
+                self.app.logger.exception(
+                    'Mail connection failed, %d of a batch of %d emails '
+                    'not sent', len(batch) - tried, len(batch))
+
+    def shutdown(self, timeout=None):
+        """
+        Send whatever is still queued, then stop the worker threads.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+mail_queue = MailQueue()
 
 def send_email(subject, sender, recipients, text_body, html_body):
     """
     Sends emails.
     See https://pythonhosted.org/Flask-Mail/ for more email options.
     See __init__.py and notes.txt for establishing email server to be used by the app.
+    The message is queued and sent in the background by mail_queue.
     """
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
-
-def send_password_reset_email(user):
-    token = user.get_reset_password_token()
-    send_email('[Microblog] Reset Your Password',
-               sender=app.config['ADMINS'][0],
-               recipients=[user.email],
-               text_body=render_template('email/reset_password.txt',
-                                         user=user, token=token),
-               html_body=render_template('email/reset_password.html',
-                                         user=user, token=token))
+    mail_queue.put(msg)
@@ -0,0 +1,25 @@
+from flask import render_template
+from app import db
+from app.hashing import HashingBusy
+from app.errors import bp
+
+"""
+Loading custom error pages.
+"""
+
+@bp.app_errorhandler(404)
+def not_found_error(error):
+    return render_template('404.html'), 404
+
+@bp.app_errorhandler(500)
+def internal_error(error):
+    db.session.rollback()
+    return render_template('500.html'), 500
+
+@bp.app_errorhandler(HashingBusy)
+def hashing_busy_error(error):
+    """
+    Too many logins are being checked at once. Ask the client to retry
+    instead of queueing the request behind them.
+    """
+    return render_template('503.html'), 503, {'Retry-After': '1'}
@@ -0,0 +1,199 @@
+from collections import deque
+from threading import Lock
+from time import time
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app.models import Post, avatar_url, gravatar_hash
+from app.pagination import KeysetPage, decode_cursor
+
+"""
+The explore page's global firehose.
+
+RecentPosts keeps the newest FIREHOSE_SIZE posts of all users in a bounded,
+process-local ring buffer, so the first pages of '/explore' are served
+without touching the database. The buffer is filled on first use and
+appended to whenever index() commits a new post. Pages older than the
+buffer fall back to a keyset query on the post table.
+
+Posts committed elsewhere (other worker processes, 'flask bulk import')
+never pass through add(). So at most every FIREHOSE_TTL seconds the
+buffer counts the posts in the database newer than the last id it knows
+of; if there are more than it was given through add(), it reloads.
+That is a range scan over the primary key, cheap next to loading.
+
+Posts are stored as small snapshots instead of ORM objects, because ORM
+objects are bound to the session of the request that loaded them.
+"""
+
+class AuthorSnapshot(object):
+    """
+    The parts of a User that _post.html needs.
+    """
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.avatar_hash = user.avatar_hash or gravatar_hash(user.email)
+
+    def avatar(self, size):
+        return avatar_url(self.avatar_hash, size)
+
+class PostSnapshot(object):
+    """
+    The parts of a Post that _post.html needs.
+    """
+    def __init__(self, post, author):
+        self.id = post.id
+        self.body = post.body
+        self.timestamp = post.timestamp
+        self.user_id = post.user_id
+        self.author = author
+
+    @property
+    def key(self):
+        return (self.timestamp, self.id)
+
+class RecentPosts(object):
+
+    def __init__(self, app=None, maxlen=None, ttl=None):
+        self.maxlen = maxlen
+        self.ttl = ttl # None: never look for posts added elsewhere
+        self._lock = Lock()
+        self.clear()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxlen = app.config['FIREHOSE_SIZE']
+        self.ttl = app.config['FIREHOSE_TTL']
+        self.clear()
+
+    def clear(self):
+        """
+        Forget everything; the buffer is reloaded on next use.
+        """
+        with self._lock:
+            self._posts = deque(maxlen=self.maxlen)
+            self._authors = {}
+            self.loaded = False
+            # True while the buffer holds every post in the database,
+            # in which case it can answer any page by itself.
+            self.complete = False
+            # the newest post id in the database at the last check, and
+            # the ids above it that add() has seen since
+            self._synced_id = 0
+            self._added = set()
+            self._checked = 0
+
+    def _author(self, user):
+        author = self._authors.get(user.id)
+        if author is None:
+            author = self._authors[user.id] = AuthorSnapshot(user)
+        return author
+
+    def load(self):
+        """
+        Fill the buffer with the newest posts. Must run in an app context.
+        """
+        checked = time()
+        synced_id = Post.query.with_entities(func.max(Post.id)).scalar() or 0
+        posts = Post.query.options(joinedload(Post.author)).order_by(
+            Post.timestamp.desc(), Post.id.desc()).limit(self.maxlen).all()
+        with self._lock:
+            self._posts = deque(maxlen=self.maxlen)
+            self._authors = {}
+            for post in posts:
+                self._posts.append(PostSnapshot(post, self._author(post.author)))
+            self.complete = len(posts) < self.maxlen
+            self.loaded = True
+            self._synced_id = synced_id
+            self._added = set()
+            self._checked = checked
+
+    def refresh(self):
+        """
+        Load the buffer if it isn't, or reload it if the database has posts
+        that didn't come through add(). The database is only asked once
+        every ttl seconds.
+        """
+        if not self.loaded:
+            self.load()
+            return
+        if self.ttl is None or time() < self._checked + self.ttl:
+            return
+        with self._lock:
+            synced_id, added = self._synced_id, len(self._added)
+            self._checked = time()
+        count, newest = Post.query.with_entities(
+            func.count(Post.id), func.max(Post.id)).filter(
+            Post.id > synced_id).one()
+        if count > added:
+            self.load()
+            return
+        with self._lock:
+            if newest is not None and self._synced_id == synced_id:
+                self._synced_id = newest
+                self._added = {id for id in self._added if id > newest}
+
+    def add(self, post):
+        """
+        Push a freshly committed post onto the front of the buffer.
+        """
+        with self._lock:
+            if not self.loaded:
+                # the post is in the database; load() will pick it up.
+                return
+            if post.id > self._synced_id:
+                self._added.add(post.id)
+            if len(self._posts) == self.maxlen:
+                self.complete = False
+            snapshot = PostSnapshot(post, self._author(post.author))
+            if self._posts and snapshot.key < self._posts[0].key:
+                posts = sorted(list(self._posts) + [snapshot],
+                               key=lambda p: p.key, reverse=True)
+                self._posts = deque(posts, maxlen=self.maxlen)
+            else:
+                self._posts.appendleft(snapshot)
+
+    def update_author(self, user):
+        """
+        Refresh the cached author details after a profile change.
+        """
+        with self._lock:
+            author = self._authors.get(user.id)
+            if author is not None:
+                author.username = user.username
+                author.avatar_hash = user.avatar_hash
+
+    def newest(self):
+        """
+        The (timestamp, id) of the newest post, or None if there are none.
+        """
+        self.refresh()
+        with self._lock:
+            return self._posts[0].key if self._posts else None
+
+    def page(self, per_page, before=None, after=None):
+        """
+        Same contract as pagination.paginate_keyset(), but served from the
+        buffer. Returns None when the page reaches past the buffered posts,
+        in which case the caller should query the database.
+        """
+        self.refresh()
+        with self._lock:
+            posts = list(self._posts)
+            complete = self.complete
+        cursor = decode_cursor(before)
+        if cursor is not None:
+            older = [p for p in posts if p.key < cursor]
+            if len(older) <= per_page and not complete:
+                return None
+            return KeysetPage(older[:per_page], len(older) > per_page, True)
+        cursor = decode_cursor(after)
+        if cursor is not None:
+            if not complete and (not posts or cursor < posts[-1].key):
+                return None
+            newer = [p for p in posts if p.key > cursor]
+            return KeysetPage(newer[-per_page:], True, len(newer) > per_page)
+        if len(posts) <= per_page and not complete:
+            return None
+        return KeysetPage(posts[:per_page], len(posts) > per_page, False)
@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import uuid
+from collections import OrderedDict
+from threading import Lock, local
+from time import time
+from flask import has_request_context, render_template, request
+from markupsafe import Markup
+
+"""
+Rendered-fragment cache for _post.html.
+
+A post's HTML only depends on the post and on its author's username and
+avatar, so index.html and user.html call render_post(post), which returns
+the HTML cached under 'post:<post id>:<author version>' and only renders
+_post.html on a miss. Each author has a version token; edit_profile()
+replaces it through invalidate_author(), so that every cached post by
+that author misses and is re-rendered with the new username. The stale
+entries are never read again and age out of the LRU. Versions are read
+once per request, not once per post. invalidate_author() also replaces
+authors_version(), which the timeline pages' validators include.
+
+Backends:
+    'memory': an LRU dict in this process (the default).
+    'sqlite': an LRU table in a local SQLite file, shared by all worker
+              processes on the machine.
+Any object with get(key), set(key, value) and clear() methods can be
+passed to init_app() as well.
+"""
+
+class MemoryBackend(object):
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class SQLiteBackend(object):
+    """
+    Fragments are stored with their last-used time. Once the table holds
+    more than maxsize entries, the least recently used tenth is evicted.
+    The time is only updated when a hit finds it more than TOUCH_INTERVAL
+    seconds old, so nearly all hits are reads and workers don't queue up
+    for the file's write lock. That makes the LRU order accurate to
+    TOUCH_INTERVAL, which is plenty for eviction.
+    """
+
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, maxsize, path):
+        self.maxsize = maxsize
+        self.path = path
+        self._local = local() # sqlite3 connections can't cross threads
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS fragment ('
+                         'key TEXT PRIMARY KEY, value TEXT, used REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_fragment_used '
+                         'ON fragment (used)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, used FROM fragment WHERE key = ?',
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        now = time()
+        if now - row[1] > self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute('UPDATE fragment SET used = ? WHERE key = ?',
+                             (now, key))
+        return row[0]
+
+    def set(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO fragment (key, value, used) '
+                         'VALUES (?, ?, ?)', (key, value, time()))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        count = conn.execute('SELECT count(*) FROM fragment').fetchone()[0]
+        if count > self.maxsize:
+            with conn:
+                conn.execute('DELETE FROM fragment WHERE key IN (SELECT key '
+                             'FROM fragment ORDER BY used LIMIT ?)',
+                             (count - self.maxsize + self.maxsize // 10,))
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM fragment')
+
+class FragmentCache(object):
+
+    def __init__(self, app=None, backend=None):
+        self.backend = self._backend = backend
+        if app is not None:
+            self.init_app(app, backend)
+
+    def init_app(self, app, backend=None):
+        backend = backend or self._backend
+        if backend is None:
+            kind = app.config['FRAGMENT_CACHE_BACKEND']
+            size = app.config['FRAGMENT_CACHE_SIZE']
+            if kind == 'memory':
+                backend = MemoryBackend(size)
+            elif kind == 'sqlite':
+                backend = SQLiteBackend(size, app.config['FRAGMENT_CACHE_PATH'])
+        self.backend = backend
+        app.add_template_global(self.render_post, 'render_post')
+
+    def _request_versions(self):
+        # versions already read in this request, by key
+        if not has_request_context():
+            return {}
+        versions = getattr(request, '_author_versions', None)
+        if versions is None:
+            versions = request._author_versions = {}
+        return versions.setdefault(id(self), {})
+
+    def _version(self, key):
+        versions = self._request_versions()
+        version = versions.get(key)
+        if version is not None:
+            return version
+        version = self.backend.get(key)
+        if version is None:
+            # a fresh token rather than a fixed default, so that an evicted
+            # version never brings back fragments rendered before a change.
+            version = uuid.uuid4().hex[:8]
+            self.backend.set(key, version)
+        versions[key] = version
+        return version
+
+    def author_version(self, user_id):
+        return self._version('author:%d' % user_id)
+
+    def authors_version(self):
+        """
+        A token that changes whenever any author is invalidated. Pages
+        listing posts of many authors (the timelines) put it in their
+        validator, so that a renamed author doesn't leave 304s with the
+        old name behind.
+        """
+        if self.backend is None:
+            return None
+        return self._version('authors')
+
+    def invalidate_author(self, user_id):
+        if self.backend is not None:
+            versions = self._request_versions()
+            for key in ('author:%d' % user_id, 'authors'):
+                version = uuid.uuid4().hex[:8]
+                self.backend.set(key, version)
+                versions[key] = version
+
+    def render_post(self, post):
+        """
+        The HTML of _post.html for this post, from the cache if possible.
+        """
+        if self.backend is None:
+            return Markup(render_template('_post.html', post=post))
+        key = 'post:%d:%s' % (post.id, self.author_version(post.user_id))
+        html = self.backend.get(key)
+        if html is None:
+            html = render_template('_post.html', post=post)
+            self.backend.set(key, html)
+        return Markup(html)
@@ -0,0 +1,80 @@
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from werkzeug.security import generate_password_hash, check_password_hash
+
+"""
+Password hashing off the request threads.
+
+PBKDF2 is deliberately slow, so a burst of logins (e.g. credential
+stuffing) can pin every worker on CPU. PasswordHasher runs the hashing in
+a pool of PASSWORD_HASH_WORKERS processes. At most PASSWORD_HASH_QUEUE
+hashes may be running or waiting at once; a request that can't get a
+slot within PASSWORD_HASH_WAIT seconds raises HashingBusy, which
+errors.py turns into a 503 so the client can try again.
+
+PASSWORD_HASH_METHOD is the werkzeug method string, including the number
+of iterations. Hashes made with a different method are upgraded the next
+time their owner logs in (see User.check_password()).
+"""
+
+class HashingBusy(Exception):
+    """
+    Raised when every password hashing slot is taken.
+    """
+    pass
+
+class PasswordHasher(object):
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._lock = Lock()
+        atexit.register(self.shutdown)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.wait = app.config['PASSWORD_HASH_WAIT']
+        self.slots = BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE'])
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn rather than fork: the app process has threads and
+                # open database connections that children shouldn't inherit.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.wait):
+            raise HashingBusy()
+        try:
+            if not self.workers:
+                # PASSWORD_HASH_WORKERS = 0 hashes on the calling thread.
+                return fn(*args)
+            return self._pool().submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        True if the hash was made with other settings than the current ones.
+        """
+        return pwhash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,71 @@
+import atexit
+from datetime import datetime
+from threading import Lock
+from time import time
+from sqlalchemy import bindparam
+from app import db
+from app.models import User
+
+"""
+Write-behind buffer for User.last_seen.
+
+Rather than committing a write transaction on every authenticated request,
+before_request() records the time in memory and the buffer writes all
+pending values in one bulk UPDATE once LAST_SEEN_FLUSH_SIZE users are
+pending or LAST_SEEN_FLUSH_INTERVAL seconds have passed since the last
+flush. Whatever is still pending is flushed when the process exits.
+"""
+
+class LastSeenBuffer(object):
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = {}
+        self._lock = Lock()
+        self._last_flush = time()
+        atexit.register(self.flush)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.app is not None:
+            self.flush() # whatever is pending belongs to the previous app
+        self.app = app
+        self.interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        self.size = app.config['LAST_SEEN_FLUSH_SIZE']
+
+    def touch(self, user_id, when=None):
+        """
+        Record that a user was seen. Flushes if a threshold was reached.
+        """
+        with self._lock:
+            self._pending[user_id] = when or datetime.utcnow()
+            due = len(self._pending) >= self.size or \
+                time() - self._last_flush >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every pending last_seen value in a single UPDATE statement.
+        Returns the number of users written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time()
+        if not pending or self.app is None:
+            return 0
+        users = User.__table__
+        stmt = users.update().where(users.c.id == bindparam('b_id')).values(
+            last_seen=bindparam('b_last_seen'))
+        try:
+            # a separate connection, so the flush never touches the
+            # session (or transaction) of the request that triggered it.
+            with db.get_engine(self.app).begin() as conn:
+                conn.execute(stmt, [{'b_id': id, 'b_last_seen': seen}
+                                    for id, seen in pending.items()])
+        except Exception:
+            # last_seen is informational, so losing one batch is acceptable.
+            self.app.logger.exception('Failed to flush last_seen updates')
+            return 0
+        return len(pending)
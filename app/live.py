@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import sqlite3
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread, local
+from time import time
+from app import fragment_cache
+from app.api.timelines import to_dict
+
+"""
+Live home timeline updates over server-sent events (SSE).
+
+A browser showing the first page of '/index' keeps a connection open to
+'/index/live'. LiveHub subscribes it to the users its owner follows, and
+index() publishes every new post after committing it. Subscribers get
+each post once, as its rendered _post.html (rendered once at publish time
+through the fragment cache) or, with ?format=json, in the API's JSON
+shape. So instead of reloading the page, and with it the timeline query,
+the browser prepends the new posts.
+
+Every subscription has a queue of at most LIVE_QUEUE_SIZE events. Publishing
+never blocks: if a client can't keep up, its queue overflows, and the
+stream sends a 'resync' event, which makes the page reload, and closes.
+When nothing happened for LIVE_HEARTBEAT seconds a comment line is sent,
+so proxies keep the connection open and dead clients are noticed. Every
+open stream holds a worker thread, so there are at most
+LIVE_MAX_SUBSCRIBERS per process. Past that limit '/index/live' answers
+503, and the page stays as it is.
+
+Brokers carry published events to the hubs:
+    'memory': straight to this process's hub (the default, one worker).
+    'sqlite': through a table in a local SQLite file. Every worker process
+              on the machine polls it every LIVE_POLL_INTERVAL seconds once
+              it has a subscriber. This stands in for a real broker such as
+              Redis pub/sub when running several workers.
+(Un)following publishes the user's new set of followed users, so open
+streams of that user on any worker follow along.
+
+Errors while polling (a locked database, a message that fails to
+deliver) are logged and polling goes on, so one failure doesn't silently
+end every stream of the worker.
+
+A stream starts at the moment it connects: a post published between
+rendering the page and opening the stream only shows up on the next load.
+"""
+
+# a child of the app's logger ('app'), so records reach its handlers
+logger = logging.getLogger(__name__)
+
+class Subscription(object):
+
+    def __init__(self, user_id, following, maxsize):
+        self.user_id = user_id
+        self.following = set(following) | {user_id}
+        self.queue = Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except Full:
+            self.overflowed = True
+            return False
+
+class MemoryBroker(object):
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def listen(self):
+        pass
+
+    def publish(self, message):
+        self.deliver(message)
+
+    def stop(self):
+        pass
+
+class SQLiteBroker(object):
+    """
+    Messages are rows with increasing ids; each process reads the rows
+    after the last one it has seen. Rows older than a minute are deleted.
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self._local = local() # sqlite3 connections can't cross threads
+        self._writes = 0
+        self._thread = None
+        self._stopped = Event()
+        self._lock = Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS event (id INTEGER '
+                         'PRIMARY KEY AUTOINCREMENT, created REAL, '
+                         'message TEXT)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def listen(self):
+        """Start polling, if we aren't already."""
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                last = self._connect().execute(
+                    'SELECT coalesce(max(id), 0) FROM event').fetchone()[0]
+                self._thread = Thread(target=self._poll, args=(last,),
+                                      daemon=True)
+                self._thread.start()
+
+    def _poll(self, last):
+        conn = self._connect()
+        while not self._stopped.wait(self.interval):
+            try:
+                for id, message in conn.execute(
+                        'SELECT id, message FROM event WHERE id > ? '
+                        'ORDER BY id', (last,)).fetchall():
+                    # past it even if it fails, so a bad message isn't
+                    # retried forever
+                    last = id
+                    self.deliver(json.loads(message))
+            except Exception:
+                logger.exception('Live broker: polling %s failed', self.path)
+
+    def publish(self, message):
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT INTO event (created, message) VALUES (?, ?)',
+                         (time(), json.dumps(message)))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            with conn:
+                conn.execute('DELETE FROM event WHERE created < ?',
+                             (time() - 60,))
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._stopped.set()
+                self._thread.join()
+                self._thread = None
+
+class LiveHub(object):
+
+    def __init__(self, app=None, broker=None):
+        self.broker = None
+        self._broker = broker
+        self._lock = Lock()
+        self._by_author = {} # user id -> subscriptions following them
+        self._by_user = {} # user id -> that user's subscriptions
+        self.dropped = 0 # events not delivered to a full queue
+        if app is not None:
+            self.init_app(app, broker)
+
+    def init_app(self, app, broker=None):
+        self.queue_size = app.config['LIVE_QUEUE_SIZE']
+        self.heartbeat = app.config['LIVE_HEARTBEAT']
+        self.max_subscribers = app.config['LIVE_MAX_SUBSCRIBERS']
+        broker = broker or self._broker
+        if broker is None:
+            kind = app.config['LIVE_BROKER']
+            if kind == 'memory':
+                broker = MemoryBroker()
+            elif kind == 'sqlite':
+                broker = SQLiteBroker(app.config['LIVE_BROKER_PATH'],
+                                      app.config['LIVE_POLL_INTERVAL'])
+        if self.broker is not None:
+            self.broker.stop()
+        self.broker = broker
+        self.broker.start(self.deliver)
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._by_user.values())
+
+    def subscribe(self, user_id, following):
+        """
+        A new Subscription to the posts of the users in following (and
+        the user's own), or None if this process has too many already.
+        """
+        subscription = Subscription(user_id, following, self.queue_size)
+        with self._lock:
+            if sum(len(subs) for subs in self._by_user.values()) >= \
+                    self.max_subscribers:
+                return None
+            self._add(subscription)
+        self.broker.listen()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop delivering to a subscription. Safe to call twice."""
+        with self._lock:
+            subs = self._by_user.get(subscription.user_id)
+            if subs is None or subscription not in subs:
+                return
+            self._remove(subscription)
+            subs.discard(subscription)
+            if not subs:
+                del self._by_user[subscription.user_id]
+
+    def _add(self, subscription):
+        self._by_user.setdefault(subscription.user_id, set()).add(subscription)
+        for author in subscription.following:
+            self._by_author.setdefault(author, set()).add(subscription)
+
+    def _remove(self, subscription):
+        # from the author index only
+        for author in subscription.following:
+            subs = self._by_author.get(author)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    del self._by_author[author]
+
+    def publish_post(self, post):
+        """
+        Send a newly committed post to everyone following its author.
+        Called from a request, as rendering _post.html needs one.
+        """
+        author = post.author
+        self.broker.publish({
+            'type': 'post',
+            'author': post.user_id,
+            'id': post.id,
+            'html': str(fragment_cache.render_post(post)),
+            'json': to_dict(post.id, post.body, post.timestamp, author.id,
+                            author.username, author.avatar_hash),
+        })
+
+    def publish_following(self, user_id, following):
+        """
+        Tell the streams of user_id that they now follow these users.
+        """
+        self.broker.publish({'type': 'following', 'user': user_id,
+                             'following': sorted(following)})
+
+    def deliver(self, message):
+        """
+        Hand a published message to the subscriptions of this process.
+        """
+        with self._lock:
+            if message['type'] == 'following':
+                for subscription in self._by_user.get(message['user'], ()):
+                    self._remove(subscription)
+                    subscription.following = set(message['following']) | \
+                        {subscription.user_id}
+                    self._add(subscription)
+                return
+            subscriptions = list(self._by_author.get(message['author'], ()))
+        for subscription in subscriptions:
+            if not subscription.put(message):
+                with self._lock:
+                    self.dropped += 1
+
+    def stream(self, subscription, format='html'):
+        """
+        The text/event-stream body for a subscription. Unsubscribes when
+        the client goes away. The caller should unsubscribe as well when
+        the response is closed, in case the body never started.
+        """
+        try:
+            # sent at once, so the client knows the stream is open
+            yield ': connected\n\n'
+            while True:
+                if subscription.overflowed:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                try:
+                    message = subscription.queue.get(timeout=self.heartbeat)
+                except Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                if format == 'json':
+                    data = 'data: ' + json.dumps(message['json'])
+                else:
+                    data = '\n'.join('data: ' + line for line in
+                                     message['html'].strip().splitlines())
+                yield 'id: {}\nevent: post\n{}\n\n'.format(message['id'], data)
+        finally:
+            self.unsubscribe(subscription)
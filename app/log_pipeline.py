@@ -0,0 +1,185 @@
+import atexit
+import copy
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, \
+    SMTPHandler
+from queue import Queue, Full
+from threading import Lock
+from time import time
+from flask import has_request_context, request
+
+"""
+Non-blocking logging for app.logger.
+
+Request threads only put records on a bounded queue (DropQueueHandler).
+A single QueueListener thread then writes them out:
+
+- as JSON lines to a RotatingFileHandler of LOG_MAX_BYTES per file
+- errors also by email through RateLimitedSMTPHandler, which sends at
+  most one email per distinct error (logger and source line) every
+  LOG_MAIL_INTERVAL seconds. The next email reports how many were held
+  back.
+
+When the queue is full, records are dropped and counted in 'dropped'
+(also on /metrics) rather than making the request wait. Because an email could otherwise
+stall the file writes, SMTP gets a timeout of LOG_MAIL_TIMEOUT seconds.
+
+Copies of the records are made picklable and request-independent before
+they are queued: the message is formatted, the traceback is rendered to text and
+the method, path and remote address of the current request are copied
+onto the record.
+"""
+
+class DropQueueHandler(QueueHandler):
+
+    def __init__(self, queue):
+        super(DropQueueHandler, self).__init__(queue)
+        self.dropped = 0
+        self._lock = Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+
+    def prepare(self, record):
+        # a copy, like QueueHandler.prepare(): handlers after this one
+        # still get the arguments and the traceback
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        if has_request_context():
+            record.request = {'method': request.method,
+                              'path': request.full_path.rstrip('?'),
+                              'remote_addr': request.remote_addr}
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc)
+                .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'source': '{}:{}'.format(record.pathname, record.lineno),
+        }
+        request_info = getattr(record, 'request', None)
+        if request_info:
+            entry['request'] = request_info
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class RateLimitedSMTPHandler(SMTPHandler):
+
+    def __init__(self, *args, interval=300, **kwargs):
+        super(RateLimitedSMTPHandler, self).__init__(*args, **kwargs)
+        self.interval = interval
+        self.suppressed = 0 # emails not sent, over all errors
+        self._last_sent = {} # error key -> time of the last email
+        self._held_back = {} # error key -> emails not sent since then
+
+    def key(self, record):
+        # record.msg has already been formatted by DropQueueHandler, so the
+        # template is only known from where the error was logged.
+        return (record.name, record.pathname, record.lineno)
+
+    def emit(self, record):
+        key = self.key(record)
+        now = time()
+        if now - self._last_sent.get(key, 0) < self.interval:
+            self._held_back[key] = self._held_back.get(key, 0) + 1
+            self.suppressed += 1
+            return
+        self._last_sent[key] = now
+        held_back = self._held_back.pop(key, 0)
+        if held_back:
+            record.msg = '{}\n\n({} more like this in the last {:.0f}s were ' \
+                         'not emailed)'.format(record.msg, held_back,
+                                               self.interval)
+        self.send(record)
+
+    def send(self, record):
+        super(RateLimitedSMTPHandler, self).emit(record)
+
+
+class LogPipeline(object):
+
+    def __init__(self, app=None):
+        self.handler = None
+        self.listener = None
+        self.mail_handler = None
+        atexit.register(self.stop)
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def dropped(self):
+        return self.handler.dropped if self.handler is not None else 0
+
+    @property
+    def emails_suppressed(self):
+        return self.mail_handler.suppressed if self.mail_handler else 0
+
+    def init_app(self, app):
+        self.stop() # one listener per process
+        handlers = []
+        log_dir = app.config['LOG_DIR']
+        if not os.path.exists(log_dir):
+            os.mkdir(log_dir)
+        # opened on the first record (delay=True)
+        file_handler = RotatingFileHandler(
+            os.path.join(log_dir, 'microblog.log'),
+            maxBytes=app.config['LOG_MAX_BYTES'],
+            backupCount=app.config['LOG_BACKUP_COUNT'], delay=True)
+        file_handler.setFormatter(JSONFormatter())
+        file_handler.setLevel(logging.INFO)
+        handlers.append(file_handler)
+
+        self.mail_handler = None
+        if app.config['MAIL_SERVER']:
+            auth = None
+            if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
+                auth = (app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
+            secure = None
+            if app.config['MAIL_USE_TLS']:
+                secure = ()
+            self.mail_handler = RateLimitedSMTPHandler(
+                mailhost=(app.config['MAIL_SERVER'], app.config['MAIL_PORT']),
+                fromaddr='no-reply@' + app.config['MAIL_SERVER'],
+                toaddrs=app.config['ADMINS'], subject='Microblog Failure',
+                credentials=auth, secure=secure,
+                timeout=app.config['LOG_MAIL_TIMEOUT'],
+                interval=app.config['LOG_MAIL_INTERVAL'])
+            self.mail_handler.setLevel(logging.ERROR)
+            self.mail_handler.setFormatter(logging.Formatter(
+                '%(asctime)s %(levelname)s: %(message)s '
+                '[in %(pathname)s:%(lineno)d]'))
+            handlers.append(self.mail_handler)
+
+        queue = Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+        self.handler = DropQueueHandler(queue)
+        app.logger.addHandler(self.handler)
+        self.listener = QueueListener(queue, *handlers,
+                                      respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Write out what is still queued and stop the listener thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
@@ -0,0 +1,49 @@
+from flask import request
+from flask_wtf import FlaskForm
+from wtforms import StringField, TextAreaField, SubmitField
+from wtforms.validators import DataRequired, Length, ValidationError
+from app.models import User
+
+class EditProfileForm(FlaskForm):
+    """
+    Form for editing user's profile.
+    Right now users can change their username and add an 'about me' section
+    to their profile.
+    """
+    username = StringField('Username', validators=[DataRequired()])
+    about_me = TextAreaField('About me', validators=[Length(min=0, max=140)])
+    submit = SubmitField('Submit')
+
+    def __init__(self, original_username, *args, **kwargs):
+        super(EditProfileForm, self).__init__(*args, **kwargs)
+        self.original_username = original_username
+
+    def validate_username(self, username):
+        if username.data != self.original_username:
+            user = User.query.filter_by(username=self.username.data).first()
+            if user is not None:
+                raise ValidationError('Please use a different username.')
+
+class EmptyForm(FlaskForm):
+    """
+    This is a button a user clicks to either follow or unfollow another user.
+    """
+    submit = SubmitField('Submit')
+
+class PostForm(FlaskForm):
+    post = TextAreaField('Say something', validators=[DataRequired(), Length(min=1,max=140)])
+    submit = SubmitField('Submit')
+
+class SearchForm(FlaskForm):
+    """
+    The search box in the navigation bar. It is submitted with GET, so the
+    query lives in the URL (request.args) and needs no CSRF token.
+    """
+    q = StringField('Search', validators=[DataRequired()])
+
+    def __init__(self, *args, **kwargs):
+        if 'formdata' not in kwargs:
+            kwargs['formdata'] = request.args
+        if 'meta' not in kwargs:
+            kwargs['meta'] = {'csrf': False}
+        super(SearchForm, self).__init__(*args, **kwargs)
@@ -0,0 +1,281 @@
+from flask import render_template, flash, redirect, url_for, request, make_response, current_app, g, Response
+from app import db, recent_posts, last_seen, fragment_cache, live_hub
+from app.main.forms import EditProfileForm, EmptyForm, PostForm, SearchForm
+from flask_login import current_user, login_required
+from app.models import User, Post, timeline, user_cache
+from app.pagination import paginate_keyset
+from app.conditional import Validator
+from app.main import bp
+
+'''
+This file contains our app\'s view functions.
+These are functions that get mapped to URLs.
+They update the contents of html pages when we call render_template(...).
+'''
+
+
+@bp.before_app_request
+def before_request():
+	"""
+	Update models.User's last_seen field in app.db.
+	@bp.before_app_request ensures this function gets called
+	before the other view functions.
+	The write itself is batched with other users' by app/last_seen.py,
+	so we don't commit a transaction on every request.
+	g.search_form is the search box shown in the navigation bar.
+	Static assets (see app/assets.py) are left alone: looking at the
+	session would add 'Vary: Cookie' and keep shared caches from storing
+	them.
+	"""
+	if request.endpoint == 'assets':
+		return
+	if current_user.is_authenticated:
+		last_seen.touch(current_user.id)
+		g.search_form = SearchForm()
+
+def suggestion_parts(suggestions):
+	"""
+	What the "who to follow" box shows, for the page validators: the box is
+	read before the validator is checked, so it is also what gets rendered.
+	"""
+	return [(user.id, user.username, user.avatar_hash, score)
+		for user, score in suggestions]
+
+# home page
+@bp.route('/', methods=['GET','POST'])
+@bp.route('/index', methods=['GET','POST'])
+@login_required # decorator used by Flask-Login to ensure a user must be logged in to view this page
+def index():
+	# making a post
+	form=PostForm()
+	if form.validate_on_submit():
+		post = Post(body=form.post.data, author=current_user)
+		db.session.add(post)
+		db.session.commit()
+		user_cache.invalidate(current_user.id) # post_count changed
+		recent_posts.add(post)
+		live_hub.publish_post(post)
+		flash('Your post is now live!')
+		return redirect(url_for('main.index'))
+		"""
+		The reason why we're redirecting back to this page is to follow the
+		post/redirect/get pattern.
+		After making a 'post' request, we should redirect always. This prevents
+		confusing / unexpected behaviour such as a user refreshing a page and
+		the most recent post request being made twice, prompting a warning message. Redirecting
+		The redirect forces a 'get' request, thwarting the duplicate-post issue.
+
+		Pagination: This involves querying for and generating a subset of all
+		values of interest from the data base. (i.e. Don't display 1,000,000
+		posts, display the latest 20.)
+		We paginate with cursors (see app/pagination.py): 'before' and
+		'after' are opaque tokens of the (timestamp, id) of the post at the
+		edge of the page, so every page costs the same as the first one.
+		From the returned page, .items returns the list of elements and
+		.next_cursor/.prev_cursor build the links to older/newer posts.
+
+		Before querying anything else, we check whether the client's copy of
+		this page is still current (see app/conditional.py). The page only
+		changes when a post lands in our timeline, we (un)follow someone,
+		our "who to follow" suggestions change or an author edits their
+		profile (the fragment cache's authors_version()).
+		"""
+	newest = db.session.query(timeline.c.timestamp, timeline.c.post_id).filter(
+		timeline.c.user_id == current_user.id).order_by(
+		timeline.c.timestamp.desc(), timeline.c.post_id.desc()).first()
+	suggestions = current_user.suggested_users(
+		current_app.config['SUGGESTIONS_SHOWN'])
+	validator = Validator(newest, current_user.graph_version,
+		suggestion_parts(suggestions), fragment_cache.authors_version(),
+		last_modified=newest.timestamp if newest else None)
+	if validator.is_current():
+		return validator.not_modified()
+	posts = paginate_keyset(current_user.followed_posts(),
+		timeline.c.timestamp, timeline.c.post_id,
+		current_app.config['POSTS_PER_PAGE'], before=request.args.get('before'),
+		after=request.args.get('after'))
+	next_url = url_for('main.index', before=posts.next_cursor) \
+		if posts.has_next else None
+	prev_url = url_for('main.index', after=posts.prev_cursor) \
+		if posts.has_prev else None
+	# the first page is kept up to date over '/index/live'
+	return validator.apply(make_response(render_template('index.html',
+		title='Home', form=form, posts=posts.items, next_url=next_url,
+		prev_url=prev_url, suggestions=suggestions, live=not posts.has_prev)))
+
+# new posts for the home page, as server-sent events
+@bp.route('/index/live')
+@login_required
+def live():
+	"""
+	An event stream of the posts of the users we follow, from the moment
+	we connect. See app/live.py. ?format=json sends the posts as JSON
+	instead of rendered _post.html.
+	The stream doesn't use the request (or the data base) once it has
+	started, so it runs without a request context.
+	"""
+	subscription = live_hub.subscribe(current_user.id,
+		current_user.followed_ids())
+	if subscription is None:
+		return 'Too many live connections.', 503, {'Retry-After': '30'}
+	response = Response(live_hub.stream(subscription,
+		request.args.get('format')), mimetype='text/event-stream',
+		headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+	response.call_on_close(lambda: live_hub.unsubscribe(subscription))
+	return response
+
+# explore page
+@bp.route('/explore')
+@login_required
+def explore():
+	"""
+	Renders the index.html template. On this page we see posts from all users
+	so that users can discover new users.
+	For details on pagination, see 'index()' above.
+	The newest posts are served from memory (see app/firehose.py); we only
+	query the data base for pages older than what recent_posts holds.
+	"""
+	newest = recent_posts.newest()
+	validator = Validator(newest, fragment_cache.authors_version(),
+		last_modified=newest[0] if newest else None)
+	if validator.is_current():
+		return validator.not_modified()
+	before = request.args.get('before')
+	after = request.args.get('after')
+	posts = recent_posts.page(current_app.config['POSTS_PER_PAGE'], before, after)
+	if posts is None:
+		posts = paginate_keyset(
+			Post.query.options(db.joinedload(Post.author)),
+			Post.timestamp, Post.id,
+			current_app.config['POSTS_PER_PAGE'], before=before, after=after)
+	next_url = url_for('main.explore', before=posts.next_cursor) \
+		if posts.has_next else None
+	prev_url = url_for('main.explore', after=posts.prev_cursor) \
+		if posts.has_prev else None
+	return validator.apply(make_response(render_template('index.html',
+		title='Explore', posts=posts.items, next_url=next_url,
+		prev_url=prev_url)))
+
+# user profile page
+@bp.route('/user/<username>')
+@login_required
+def user(username):
+	user = User.query.filter_by(username=username).first_or_404()
+	# our own profile also shows who we might follow
+	suggestions = current_user.suggested_users(
+		current_app.config['SUGGESTIONS_SHOWN']) if user == current_user else []
+	validator = Validator(user.id, user.username, user.about_me,
+		user.last_seen, user.avatar_hash, user.post_count, user.follower_count,
+		user.followed_count, current_user.is_following(user),
+		suggestion_parts(suggestions))
+	if validator.is_current():
+		return validator.not_modified()
+	posts = paginate_keyset(user.posts.options(db.joinedload(Post.author)),
+		Post.timestamp, Post.id,
+		current_app.config['POSTS_PER_PAGE'], before=request.args.get('before'),
+		after=request.args.get('after'))
+	next_url = url_for('main.user', username=user.username,
+		before=posts.next_cursor) if posts.has_next else None
+	prev_url = url_for('main.user', username=user.username,
+		after=posts.prev_cursor) if posts.has_prev else None
+	'''
+	note, above we use url_for to pass extra arguments.
+	username specifies the user whose profile page we're targetting.
+	the before/after cursors are used in this function to determine which
+	of this user's posts should be displayed (pagination).
+
+	below, if we're viewing someone else's profile, form serves as the
+	follow/unfollow button.
+	'''
+	form = EmptyForm()
+	return validator.apply(make_response(render_template('user.html',
+		user=user, posts=posts.items, form=form, next_url=next_url,
+		prev_url=prev_url, suggestions=suggestions)))
+
+# search results
+@bp.route('/search')
+@login_required
+def search():
+	"""
+	Posts matching the navigation bar's search box, best match first.
+	Ranked results are paginated with an 'after' cursor, like the
+	timelines (see Post.search and app/search.py).
+	"""
+	if not g.search_form.validate():
+		return redirect(url_for('main.explore'))
+	q = g.search_form.q.data
+	posts = Post.search(q, current_app.config['POSTS_PER_PAGE'],
+		after=request.args.get('after'))
+	next_url = url_for('main.search', q=q, after=posts.next_cursor) \
+		if posts.has_next else None
+	return render_template('search.html', title='Search', posts=posts.items,
+		next_url=next_url)
+
+# edit profile page
+@bp.route('/edit_profile', methods=['GET', 'POST'])
+@login_required
+def edit_profile():
+    form = EditProfileForm(current_user.username)
+    if form.validate_on_submit():
+        current_user.username = form.username.data
+        current_user.about_me = form.about_me.data
+        db.session.commit()
+        user_cache.invalidate(current_user.id)
+        recent_posts.update_author(current_user)
+        fragment_cache.invalidate_author(current_user.id)
+        flash('Your changes have been saved.')
+        return redirect(url_for('main.edit_profile'))
+    elif request.method == 'GET':
+        form.username.data = current_user.username
+        form.about_me.data = current_user.about_me
+    return render_template('edit_profile.html', title='Edit Profile',
+                           form=form)
+
+# following and unfollowing users
+@bp.route('/follow/<username>', methods=['POST'])
+@login_required
+def follow(username):
+    form = EmptyForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            flash('User {} not found.'.format(username))
+            return redirect(url_for('main.index'))
+        if user == current_user:
+            flash('You cannot follow yourself!')
+            return redirect(url_for('main.user', username=username))
+        current_user.follow(user)
+        db.session.commit()
+        user_cache.invalidate(current_user.id, user.id) # counters changed
+        live_hub.publish_following(current_user.id,
+                                   current_user.followed_ids())
+        flash('You are following {}!'.format(username))
+        return redirect(url_for('main.user', username=username))
+    else:
+        return redirect(url_for('main.index'))
+
+@bp.route('/unfollow/<username>', methods=['POST'])
+@login_required
+def unfollow(username):
+    form = EmptyForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            flash('User {} not found.'.format(username))
+            return redirect(url_for('main.index'))
+        if user == current_user:
+            flash('You cannot unfollow yourself!')
+            return redirect(url_for('main.user', username=username))
+        current_user.unfollow(user)
+        db.session.commit()
+        user_cache.invalidate(current_user.id, user.id) # counters changed
+        live_hub.publish_following(current_user.id,
+                                   current_user.followed_ids())
+        flash('You are not following {}.'.format(username))
+        return redirect(url_for('main.user', username=username))
+    else:
+        return redirect(url_for('main.index'))
+
+@bp.route('/break_app')
+def break_app():
+	return None
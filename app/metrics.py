@@ -0,0 +1,242 @@
+from bisect import bisect_left
+from threading import Lock, local
+from time import perf_counter
+from flask import Response, current_app, request
+from flask.signals import signals_available, before_render_template, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+Per-request performance metrics, served in Prometheus' text format on
+/metrics.
+
+For every request we record, per endpoint:
+- the latency
+- the number of SQL statements and the time spent in them
+- the time spent rendering templates, measured on the outermost
+  template so included and fragment templates aren't counted twice
+- the size of the response body
+
+Each value goes into a histogram, so Prometheus can compute percentiles
+across workers. The values live in this process; every worker serves its
+own /metrics.
+
+With METRICS_SLOW_REQUEST set to a number of seconds, requests that take
+longer are logged as warnings, listed with their SQL statements and
+their timings.
+
+The hooks are cheap enough to leave on: a couple of perf_counter() calls
+and one thread-local lookup per SQL statement, plus a lock around a few
+bucket increments per request. Statement texts are only kept when the
+slow request log is on.
+"""
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# at most this many statements are kept for the slow request log
+MAX_LOGGED_STATEMENTS = 50
+
+# the request being measured by the current thread
+_current = local()
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats(object):
+
+    def __init__(self, keep_statements):
+        self.start = perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = [] if keep_statements else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if getattr(_current, 'stats', None) is not None:
+        conn.info.setdefault('metrics_start', []).append(perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = getattr(_current, 'stats', None)
+    starts = conn.info.get('metrics_start')
+    if stats is None or not starts:
+        return
+    elapsed = perf_counter() - starts.pop()
+    stats.sql_count += 1
+    stats.sql_time += elapsed
+    if stats.statements is not None and \
+            len(stats.statements) < MAX_LOGGED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+class Metrics(object):
+
+    # name: (help, buckets)
+    histograms = {
+        'microblog_request_duration_seconds':
+            ('Time spent handling the request.', LATENCY_BUCKETS),
+        'microblog_request_sql_statements':
+            ('SQL statements executed per request.', COUNT_BUCKETS),
+        'microblog_request_sql_seconds':
+            ('Time spent in SQL statements per request.', LATENCY_BUCKETS),
+        'microblog_request_template_seconds':
+            ('Time spent rendering templates per request.', LATENCY_BUCKETS),
+        'microblog_response_size_bytes':
+            ('Size of the response body.', SIZE_BUCKETS),
+    }
+
+    def __init__(self, app=None):
+        self._lock = Lock()
+        self._counters = {} # name -> (help, fn)
+        self.clear()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_SLOW_REQUEST', 0)
+        if not app.config['METRICS_ENABLED']:
+            return
+        self.slow_request = app.config['METRICS_SLOW_REQUEST']
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        if signals_available:
+            before_render_template.connect(self.before_render, app)
+            template_rendered.connect(self.after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def clear(self):
+        with self._lock:
+            self._data = {} # (name, labels) -> Histogram
+            self._requests = {} # labels -> count
+
+    def counter(self, name, help, fn):
+        """
+        Also export the value of fn() as a counter, e.g. a count kept by
+        another part of the app.
+        """
+        with self._lock:
+            self._counters[name] = (help, fn)
+
+    def before_request(self):
+        _current.stats = RequestStats(self.slow_request > 0)
+
+    def after_request(self, response):
+        stats = getattr(_current, 'stats', None)
+        if stats is None:
+            return response
+        elapsed = perf_counter() - stats.start
+        endpoint = request.endpoint or 'none'
+        labels = (('endpoint', endpoint), ('method', request.method))
+        # streamed responses have no length until they've been sent
+        size = None if response.is_streamed else response.calculate_content_length()
+        with self._lock:
+            self._observe('microblog_request_duration_seconds', labels, elapsed)
+            self._observe('microblog_request_sql_statements', labels,
+                          stats.sql_count)
+            self._observe('microblog_request_sql_seconds', labels,
+                          stats.sql_time)
+            self._observe('microblog_request_template_seconds', labels,
+                          stats.template_time)
+            if size is not None:
+                self._observe('microblog_response_size_bytes', labels, size)
+            key = labels + (('status', str(response.status_code)),)
+            self._requests[key] = self._requests.get(key, 0) + 1
+        if self.slow_request and elapsed >= self.slow_request:
+            self.log_slow_request(elapsed, stats)
+        return response
+
+    def teardown_request(self, exc):
+        _current.stats = None
+
+    def before_render(self, app, template, context):
+        stats = getattr(_current, 'stats', None)
+        if stats is not None:
+            if stats.template_depth == 0:
+                stats.template_start = perf_counter()
+            stats.template_depth += 1
+
+    def after_render(self, app, template, context):
+        stats = getattr(_current, 'stats', None)
+        if stats is not None and stats.template_depth:
+            stats.template_depth -= 1
+            if stats.template_depth == 0:
+                stats.template_time += perf_counter() - stats.template_start
+
+    def _observe(self, name, labels, value):
+        histogram = self._data.get((name, labels))
+        if histogram is None:
+            histogram = self._data[(name, labels)] = Histogram(
+                self.histograms[name][1])
+        histogram.observe(value)
+
+    def log_slow_request(self, elapsed, stats):
+        lines = ['Slow request: {} {} took {:.3f}s, {} SQL statements in '
+                 '{:.3f}s, templates {:.3f}s'.format(
+                 request.method, request.full_path, elapsed, stats.sql_count,
+                 stats.sql_time, stats.template_time)]
+        for seconds, statement in sorted(stats.statements, reverse=True):
+            lines.append('  {:.4f}s {}'.format(seconds, ' '.join(
+                statement.split())))
+        current_app.logger.warning('\n'.join(lines))
+
+    def render(self):
+        """The /metrics view."""
+        with self._lock:
+            data = sorted(self._data.items())
+            requests = sorted(self._requests.items())
+            counters = sorted(self._counters.items())
+        out = ['# HELP microblog_requests_total Requests handled.',
+               '# TYPE microblog_requests_total counter']
+        for labels, count in requests:
+            out.append('microblog_requests_total{} {}'.format(
+                _labels(labels), count))
+        for name, (help, fn) in counters:
+            out.append('# HELP {} {}'.format(name, help))
+            out.append('# TYPE {} counter'.format(name))
+            out.append('{} {}'.format(name, fn()))
+        for name in sorted(self.histograms):
+            out.append('# HELP {} {}'.format(name, self.histograms[name][0]))
+            out.append('# TYPE {} histogram'.format(name))
+            for (hname, labels), histogram in data:
+                if hname != name:
+                    continue
+                total = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',),
+                                        histogram.counts):
+                    total += count
+                    out.append('{}_bucket{} {}'.format(name, _labels(
+                        labels + (('le', str(bound)),)), total))
+                out.append('{}_sum{} {}'.format(name, _labels(labels),
+                                                histogram.sum))
+                out.append('{}_count{} {}'.format(name, _labels(labels),
+                                                  histogram.count))
+        return Response('\n'.join(out) + '\n',
+                        mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    return '{' + ','.join('{}="{}"'.format(name, value.replace(
+        '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels) + '}'
@@ -0,0 +1,49 @@
+"""
+Flask-Migrate without importing alembic at startup.
+
+flask_migrate.Migrate needs alembic, which takes a few hundred
+milliseconds to import, although only the 'flask db' commands (and calls
+like flask_migrate.upgrade() from a deploy script) ever use it. Migrate
+here stores the same app.extensions['migrate'] entry that Flask-Migrate
+does, but only builds the real Migrate object, and so imports alembic,
+when one of those asks for it. The 'flask db' command group comes from
+Flask-Migrate's own entry point and is not affected.
+"""
+
+class MigrateConfig(object):
+    """
+    What Flask-Migrate's commands and migrations/env.py read from
+    app.extensions['migrate'].
+    """
+
+    def __init__(self, db, directory, **kwargs):
+        self.db = db
+        self.directory = directory
+        self.configure_args = kwargs
+        self._migrate = None
+
+    @property
+    def metadata(self):
+        return self.db.metadata
+
+    @property
+    def migrate(self):
+        if self._migrate is None:
+            from flask_migrate import Migrate as FlaskMigrate
+            self._migrate = FlaskMigrate(db=self.db, directory=self.directory,
+                                         **self.configure_args)
+        return self._migrate
+
+
+class Migrate(object):
+
+    def __init__(self, app=None, db=None, directory='migrations', **kwargs):
+        self.db = db
+        self.directory = directory
+        self.kwargs = kwargs
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        app.extensions['migrate'] = MigrateConfig(
+            db or self.db, str(self.directory), **self.kwargs)
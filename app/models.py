@@ -1,19 +1,68 @@
 from datetime import datetime
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from app import login, app
+from app import login, password_hasher, search_index
+from flask import current_app
 from hashlib import md5
 from time import time
+from sqlalchemy import DDL, event, literal
+from sqlalchemy.orm import validates
 import jwt
+from app.user_cache import UserCache
+from app.hashing import HashingBusy
+from app.pagination import RankedPage, decode_rank_cursor
+from app.search import CREATE_FTS5
 
 
 # followers is an auxillary table that exhibits a many-to-many relationship.
 # auxillary tables in SQL terms typically store only foreign keys, which is
 # why we don't construct it as a Model subclass.
+# The primary key doubles as the index for "who does A follow?", and the
+# second index answers "who follows B?" without scanning the table.
 followers = db.Table('followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id',
+             'follower_id')
+    )
+
+# timeline is the materialized home timeline. It holds one row per
+# (reader, post) pair, so that reading a user's home page is a single range
+# scan over the (user_id, timestamp) index instead of a sorted UNION.
+# Rows are written when a post is created (fan-out-on-write, see fan_out_post
+# below) and backfilled or pruned when a user follows or unfollows someone.
+timeline = db.Table('timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'),
+              primary_key=True),
+    db.Column('timestamp', db.DateTime),
+    db.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp',
+             'post_id')
+    )
+
+# suggestion holds the precomputed "who to follow" lists: the best
+# SUGGESTIONS_PER_USER candidates for every user, by rank, with their score
+# (how many of the users we follow follow them). 'flask suggestions compute'
+# (see app/suggestions.py) writes them; suggestion_state records hashes of
+# the part of the graph each list was computed from, so the job only redoes
+# the users whose neighbourhood changed since.
+suggestion = db.Table('suggestion',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('rank', db.SmallInteger, primary_key=True),
+    db.Column('suggested_id', db.Integer, db.ForeignKey('user.id')),
+    db.Column('score', db.Integer)
+    )
+
+suggestion_state = db.Table('suggestion_state',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('followed_hash', db.BigInteger),
+    db.Column('neighborhood_hash', db.BigInteger),
+    db.Column('computed', db.DateTime)
     )
 
 class User(UserMixin, db.Model):
@@ -28,10 +77,18 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
+    avatar_hash = db.Column(db.String(32)) # md5 of email, see avatar()
     password_hash = db.Column(db.String(128))
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # denormalized counters, kept up to date by follow(), unfollow() and
+    # fan_out_post(). 'flask counters repair' recomputes them.
+    follower_count = db.Column(db.Integer, default=0, server_default='0')
+    followed_count = db.Column(db.Integer, default=0, server_default='0')
+    post_count = db.Column(db.Integer, default=0, server_default='0')
+    # bumped whenever this user follows, unfollows or is (un)followed.
+    graph_version = db.Column(db.Integer, default=0, server_default='0')
 
 
     '''
@@ -60,13 +117,14 @@ class User(UserMixin, db.Model):
     def followed_posts(self):
         """
         Query the data base for all posts from the followed users
-        of a user.
+        of a user, plus the user's own posts.
 
-        Below, we are joining the Post table with the aux. followers table.
-        From that table, we filter by which the followed user == Post.user_id.
-        Then, we want to include (union in) our own posts into the timeline.
-        So we find our posts and union them with the followed posts.
-        Finally, we order by descending order of timestamp.
+        The timeline table already holds one row for every post this user
+        should see, so we only have to join it with the Post table and read
+        our own rows in descending order of timestamp. This is a range scan
+        over the timeline index, no matter how many users we follow.
+        Authors are loaded in the same query, so rendering the posts does
+        not issue one extra SELECT per author.
 
         The object returned is a SQLAlchemy query object.
         When calling this function, we should immediately call a method like
@@ -75,11 +133,10 @@ class User(UserMixin, db.Model):
         ex. from '/index' route:
         posts = current_user.followed_posts().all()
         """
-        just_followed_posts = Post.query.join(
-        followers, (followers.c.followed_id==Post.user_id)).filter(
-        followers.c.follower_id==self.id)
-        own_posts = Post.query.filter_by(user_id=self.id)
-        return just_followed_posts.union(own_posts).order_by(Post.timestamp.desc())
+        return Post.query.options(db.joinedload(Post.author)).join(
+            timeline, (timeline.c.post_id == Post.id)).filter(
+            timeline.c.user_id == self.id).order_by(
+            timeline.c.timestamp.desc())
 
     def __repr__(self):
         """
@@ -88,18 +145,42 @@ class User(UserMixin, db.Model):
         return '<User {}>'.format(self.username)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.generate(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        '''
+        Hashing runs in password_hasher's process pool (see app/hashing.py).
+        If the password is right but the hash was made with old settings,
+        it is replaced with a fresh hash; the caller should commit. When
+        the hasher is too busy for that, the upgrade waits for a later
+        login rather than failing this one.
+        '''
+        if not password_hasher.check(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            try:
+                self.set_password(password)
+            except HashingBusy:
+                pass
+        return True
+
+    @validates('email')
+    def validate_email(self, key, email):
+        '''
+        Keep avatar_hash in step with the email, so avatar() doesn't have to
+        hash the email every time a post is rendered.
+        '''
+        if email is not None:
+            self.avatar_hash = gravatar_hash(email)
+        return email
 
     def avatar(self, size):
         '''
         Gravatar is an avatar generating service.
         Below we are encoding the lower-cased email as bytes and requesting an avatar
-        from gravatar.
+        from gravatar. The hash is computed once and stored in avatar_hash.
         '''
-        return 'https://www.gravatar.com/avatar/%s?d=identicon&s=%d' % (md5(self.email.encode('utf-8')).hexdigest(), size)
+        return avatar_url(self.avatar_hash or gravatar_hash(self.email), size)
 
     '''
     Implement following and unfollowing other users.
@@ -107,11 +188,72 @@ class User(UserMixin, db.Model):
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            self.followed_ids().add(user.id)
+            # flush first so that posts still pending in the session are
+            # either fanned out to us or picked up by the backfill below.
+            db.session.flush()
+            db.session.execute(timeline.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'],
+                db.select([literal(self.id), Post.id, Post.timestamp]).where(
+                    Post.user_id == user.id).where(~db.exists().where(
+                    db.and_(timeline.c.user_id == self.id,
+                            timeline.c.post_id == Post.id)))))
+            self._count_follow(user, 1)
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            self.followed_ids().discard(user.id)
+            db.session.execute(timeline.delete().where(
+                timeline.c.user_id == self.id).where(
+                timeline.c.post_id.in_(
+                    db.select([Post.id]).where(Post.user_id == user.id))))
+            self._count_follow(user, -1)
     def is_following(self, user):
-        return self.followed.filter(followers.c.followed_id==user.id).count() > 0
+        return user.id in self.followed_ids()
+    def followed_ids(self):
+        """
+        The ids of the users we follow, as a set of ints.
+        It is loaded with one query the first time it's needed and kept on
+        this User object, which lives for one request, so is_following()
+        (e.g. for every follow button on a page) doesn't query again.
+        follow() and unfollow() keep it up to date, and it is dropped when
+        the session expires the object (commit or rollback).
+        """
+        ids = self.__dict__.get('_followed_ids')
+        if ids is None:
+            ids = set(id for id, in db.session.query(
+                followers.c.followed_id).filter(
+                followers.c.follower_id == self.id))
+            if self.id is not None:
+                self._followed_ids = ids
+        return ids
+    def suggested_users(self, limit):
+        """
+        Up to limit (user, score) pairs from our precomputed suggestions,
+        best first. Users we have followed since the list was computed are
+        left out, so the widget is right even when the list is stale.
+        """
+        return db.session.query(User, suggestion.c.score).join(
+            suggestion, suggestion.c.suggested_id == User.id).filter(
+            suggestion.c.user_id == self.id).filter(~db.exists().where(
+            db.and_(followers.c.follower_id == self.id,
+                    followers.c.followed_id == User.id))).order_by(
+            suggestion.c.rank).limit(limit).all()
+    def _count_follow(self, user, delta):
+        """
+        Adjust the follow counters in SQL (count = count + delta), so that
+        concurrent follows don't overwrite each other, then expire the
+        in-memory values so they are reloaded on next access.
+        """
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.id == self.id).values(
+            followed_count=users.c.followed_count + delta,
+            graph_version=users.c.graph_version + 1))
+        db.session.execute(users.update().where(users.c.id == user.id).values(
+            follower_count=users.c.follower_count + delta,
+            graph_version=users.c.graph_version + 1))
+        db.session.expire(self, ['followed_count', 'graph_version'])
+        db.session.expire(user, ['follower_count', 'graph_version'])
 
     # Resetting passwords
     def get_reset_password_token(self, expires_in=600):
@@ -129,26 +271,139 @@ class User(UserMixin, db.Model):
 
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
-            app.config['SECRET_KEY'], algorithm='HS256')
+            current_app.config['SECRET_KEY'], algorithm='HS256')
 
     @staticmethod
     def verify_reset_password_token(token):
         try:
-            id = jwt.decode(token, app.config['SECRET_KEY'],
+            id = jwt.decode(token, current_app.config['SECRET_KEY'],
                             algorithms=['HS256'])['reset_password']
         except:
             return
         return User.query.get(id)
 
+def gravatar_hash(email):
+    return md5(email.encode('utf-8')).hexdigest()
+
+def avatar_url(avatar_hash, size):
+    return 'https://www.gravatar.com/avatar/%s?d=identicon&s=%d' % (avatar_hash, size)
+
+@event.listens_for(User, 'expire')
+def drop_followed_ids(user, attrs):
+    # attrs is None when the whole object is expired, e.g. after a commit.
+    if attrs is None:
+        user.__dict__.pop('_followed_ids', None)
+
+user_cache = UserCache(User)
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    # see app/user_cache.py; most requests are served without a SELECT.
+    return user_cache.load(int(id))
 
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # covers a user's profile timeline and its (timestamp, id) cursor.
+    __table_args__ = (
+        db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return '<Post {}>'.format(self.body)
+
+    @classmethod
+    def search(cls, expression, per_page, after=None):
+        """
+        Posts matching every word of expression, best match first.
+        after is the next_cursor token of the previous page.
+        See app/search.py for how the index is kept.
+        """
+        hits = search_index.search(db.session.connection(), expression,
+                                   per_page + 1, decode_rank_cursor(after))
+        page = hits[:per_page]
+        ids = [id for score, id in page]
+        posts = {}
+        if ids:
+            posts = {post.id: post for post in cls.query.options(
+                db.joinedload(cls.author)).filter(cls.id.in_(ids))}
+        # keep the index's order; ids whose post is gone are skipped
+        return RankedPage([posts[id] for id in ids if id in posts],
+                          len(hits) > per_page, page[-1] if page else None)
+
+
+@event.listens_for(Post, 'after_insert')
+def fan_out_post(mapper, connection, post):
+    """
+    Fan-out-on-write: copy a new post into the timeline of its author and
+    of every user following the author, and bump the author's post_count.
+    Runs inside the flush, so these rows commit (or roll back) together
+    with the post.
+    """
+    if post.user_id is None:
+        return
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == post.user_id).values(
+        post_count=users.c.post_count + 1))
+    connection.execute(timeline.insert().values(
+        user_id=post.user_id, post_id=post.id, timestamp=post.timestamp))
+    connection.execute(timeline.insert().from_select(
+        ['user_id', 'post_id', 'timestamp'],
+        db.select([followers.c.follower_id, literal(post.id),
+                   literal(post.timestamp)]).where(
+            followers.c.followed_id == post.user_id).where(
+            followers.c.follower_id != post.user_id)))
+
+# the FTS5 search index (see app/search.py) lives and dies with the post
+# table when the schema comes from create_all(), as in the tests; databases
+# managed by migrations get it from one.
+event.listen(Post.__table__, 'after_create',
+             DDL(CREATE_FTS5).execute_if(dialect='sqlite'))
+event.listen(Post.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS post_fts').execute_if(dialect='sqlite'))
+
+@event.listens_for(Post, 'after_insert')
+def index_post(mapper, connection, post):
+    search_index.add(connection, post.id, post.body)
+
+@event.listens_for(Post, 'after_delete')
+def unindex_post(mapper, connection, post):
+    search_index.remove(connection, post.id, post.body)
+
+def rebuild_timelines():
+    """
+    Rebuild every user's home timeline from the post and followers tables.
+    Used by 'flask timeline rebuild' to fill the timeline for existing data.
+    Returns the number of timeline rows written.
+    """
+    db.session.execute(timeline.delete())
+    db.session.execute(timeline.insert().from_select(
+        ['user_id', 'post_id', 'timestamp'],
+        db.select([Post.user_id, Post.id, Post.timestamp]).where(
+            Post.user_id != None)))
+    db.session.execute(timeline.insert().from_select(
+        ['user_id', 'post_id', 'timestamp'],
+        db.select([followers.c.follower_id, Post.id, Post.timestamp]).where(
+            followers.c.followed_id == Post.user_id).where(
+            followers.c.follower_id != Post.user_id).distinct()))
+    db.session.commit()
+    return db.session.query(timeline).count()
+
+def repair_counters():
+    """
+    Recompute every user's follower_count, followed_count and post_count.
+    Used by 'flask counters repair'. Returns the number of users updated.
+    """
+    users = User.__table__
+    count = db.func.count()
+    result = db.session.execute(users.update().values(
+        follower_count=db.select([count]).where(
+            followers.c.followed_id == users.c.id).as_scalar(),
+        followed_count=db.select([count]).where(
+            followers.c.follower_id == users.c.id).as_scalar(),
+        post_count=db.select([count]).where(
+            Post.user_id == users.c.id).as_scalar()))
+    db.session.commit()
+    return result.rowcount
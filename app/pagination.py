@@ -0,0 +1,116 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+"""
+Keyset (cursor) pagination for timelines.
+
+Instead of paginate(page, ...), which runs an OFFSET query plus a COUNT(*),
+we remember the (timestamp, id) of the last post shown and ask the database
+for the posts just before it. The cursor is handed to the client as an
+opaque 'before=' or 'after=' token, so page N costs the same as page 1.
+"""
+
+def encode_cursor(timestamp, id):
+    raw = '{}|{}'.format(timestamp.isoformat(), id).encode('utf-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """
+    Returns a (timestamp, id) tuple, or None if the token is missing or
+    malformed, in which case the caller shows the first page.
+    """
+    if not token:
+        return None
+    try:
+        raw = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, id = raw.decode('utf-8').rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, TypeError):
+        return None
+
+def encode_rank_cursor(score, id):
+    raw = '{!r}|{}'.format(score, id).encode('utf-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_rank_cursor(token):
+    """
+    Returns a (score, id) tuple for ranked results such as search, or None
+    like decode_cursor().
+    """
+    if not token:
+        return None
+    try:
+        raw = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        score, id = raw.decode('utf-8').rsplit('|', 1)
+        return float(score), int(id)
+    except (ValueError, TypeError):
+        return None
+
+class KeysetPage(object):
+    """
+    One page of results. Mirrors the parts of flask_sqlalchemy's Pagination
+    that our views use, minus the total count.
+    'next' means older posts and 'prev' means newer posts.
+    """
+    def __init__(self, items, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return encode_cursor(self.items[-1].timestamp, self.items[-1].id)
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return encode_cursor(self.items[0].timestamp, self.items[0].id)
+
+class RankedPage(object):
+    """
+    One page of ranked results. Rankings can't be walked backwards cheaply,
+    so there is only a 'next' link; last is the (score, id) of the last
+    result on the page.
+    """
+    def __init__(self, items, has_next, last=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = False
+        self.last = last
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.last is not None:
+            return encode_rank_cursor(*self.last)
+
+def paginate_keyset(query, timestamp_col, id_col, per_page,
+                    before=None, after=None):
+    """
+    Paginate a query in descending (timestamp, id) order.
+
+    timestamp_col and id_col are the columns the cursor is compared with.
+    They should be covered by an index together with the query's filter
+    columns, e.g. timeline (user_id, timestamp, post_id).
+    before: token of the oldest post on the previous page (older posts).
+    after: token of the newest post on the following page (newer posts).
+    """
+    query = query.order_by(None)
+    cursor = decode_cursor(before)
+    if cursor is not None:
+        timestamp, id = cursor
+        items = query.filter(or_(timestamp_col < timestamp, and_(
+            timestamp_col == timestamp, id_col < id))).order_by(
+            timestamp_col.desc(), id_col.desc()).limit(per_page + 1).all()
+        return KeysetPage(items[:per_page], len(items) > per_page, True)
+    cursor = decode_cursor(after)
+    if cursor is not None:
+        timestamp, id = cursor
+        items = query.filter(or_(timestamp_col > timestamp, and_(
+            timestamp_col == timestamp, id_col > id))).order_by(
+            timestamp_col.asc(), id_col.asc()).limit(per_page + 1).all()
+        return KeysetPage(items[:per_page][::-1], True, len(items) > per_page)
+    items = query.order_by(timestamp_col.desc(), id_col.desc()).limit(
+        per_page + 1).all()
+    return KeysetPage(items[:per_page], len(items) > per_page, False)
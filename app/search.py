@@ -0,0 +1,223 @@
+import math
+import re
+from collections import defaultdict
+from threading import Lock
+from weakref import WeakSet
+from sqlalchemy import text
+
+"""
+Full-text search over post bodies.
+
+SearchIndex keeps an inverted index of Post.body and answers ranked
+queries with it, so searching never scans the post table. There are two
+backends:
+
+- FTS5Backend (SQLite): an external content FTS5 table, post_fts, whose
+  rows point back at post.id. The migration creates and fills it (and
+  create_all() creates it along with the post table, see models.py). It
+  is written in the same transaction as the post, so it commits or rolls
+  back with it.
+  Results are ranked with FTS5's bm25().
+- MemoryIndex (any other database): term -> {post id: term count}
+  postings held in this process and ranked with the same BM25 formula.
+  It is loaded from the post table on first use. Like the memory fragment
+  cache it is per process, so other workers' posts only show up after
+  a restart or 'flask search reindex'.
+
+Both return (score, post id) pairs, best first, where a lower score is a
+better match (bm25() convention). Ties are broken by newest id, and the
+pair of the last result is the cursor for the next page.
+
+Queries are split into words and every word must match. FTS5 operators
+are not passed through, so user input can't produce syntax errors.
+"""
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+CREATE_FTS5 = ("CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING "
+               "fts5(body, content='post', content_rowid='id')")
+
+
+def terms(expression):
+    return [word.lower() for word in WORD.findall(expression or '')]
+
+
+def after_cursor(results, after):
+    """
+    Keep the results that come after the (score, id) cursor in
+    (score ascending, id descending) order.
+    """
+    if after is None:
+        return results
+    score, id = after
+    return [(s, i) for s, i in results if s > score or (s == score and i < id)]
+
+
+class FTS5Backend(object):
+
+    def __init__(self):
+        self._ready = WeakSet() # engines known to have the post_fts table
+
+    def create(self, conn):
+        # runs in the caller's transaction, so the table only exists once
+        # that commits. It's a no-op if the table is already there.
+        conn.execute(text(CREATE_FTS5))
+
+    def exists(self, conn):
+        if conn.engine not in self._ready:
+            if conn.execute(text("SELECT 1 FROM sqlite_master "
+                                 "WHERE name = 'post_fts'")).first() is None:
+                return False
+            self._ready.add(conn.engine)
+        return True
+
+    def add(self, conn, id, body):
+        conn.execute(text('INSERT INTO post_fts (rowid, body) VALUES (:id, :body)'),
+                     {'id': id, 'body': body})
+
+    def remove(self, conn, id, body):
+        # external content tables need the old value to remove its terms
+        conn.execute(text("INSERT INTO post_fts (post_fts, rowid, body) "
+                          "VALUES ('delete', :id, :body)"),
+                     {'id': id, 'body': body})
+
+    def search(self, conn, words, limit, after=None):
+        if not self.exists(conn):
+            return [] # nothing posted or indexed yet
+        match = ' '.join('"{}"'.format(word) for word in words)
+        params = {'match': match, 'limit': limit}
+        where = ''
+        if after is not None:
+            where = 'WHERE score > :score OR (score = :score AND id < :id)'
+            params['score'], params['id'] = after
+        rows = conn.execute(text(
+            'SELECT score, id FROM (SELECT bm25(post_fts) AS score, rowid AS id '
+            'FROM post_fts WHERE post_fts MATCH :match) {} '
+            'ORDER BY score, id DESC LIMIT :limit'.format(where)), params)
+        return [(score, id) for score, id in rows]
+
+    def reindex(self, conn):
+        self.create(conn)
+        conn.execute(text("INSERT INTO post_fts (post_fts) VALUES ('rebuild')"))
+        return conn.execute(text('SELECT count(*) FROM post')).scalar()
+
+
+class MemoryIndex(object):
+
+    # BM25 parameters, the same defaults FTS5 uses
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._lengths = {}
+            self._total = 0
+            self._loaded = False
+
+    def load(self, conn):
+        """Fill the index from the post table, once."""
+        if self._loaded:
+            return
+        rows = conn.execute(text('SELECT id, body FROM post')).fetchall()
+        with self._lock:
+            if not self._loaded:
+                for id, body in rows:
+                    self._add(id, body)
+                self._loaded = True
+
+    def _add(self, id, body):
+        words = terms(body)
+        for word in words:
+            counts = self._postings[word]
+            counts[id] = counts.get(id, 0) + 1
+        self._lengths[id] = len(words)
+        self._total += len(words)
+
+    def add(self, conn, id, body):
+        # before the first load the row is picked up by load() anyway
+        with self._lock:
+            if self._loaded and id not in self._lengths:
+                self._add(id, body)
+
+    def remove(self, conn, id, body):
+        with self._lock:
+            length = self._lengths.pop(id, None)
+            if length is None:
+                return
+            self._total -= length
+            for word in set(terms(body)):
+                self._postings.get(word, {}).pop(id, None)
+
+    def search(self, conn, words, limit, after=None):
+        self.load(conn)
+        with self._lock:
+            postings = [self._postings.get(word, {}) for word in set(words)]
+            if not postings or not all(postings):
+                return []
+            n = len(self._lengths)
+            average = self._total / n
+            postings.sort(key=len)
+            scores = {}
+            for id in postings[0]:
+                if all(id in p for p in postings[1:]):
+                    scores[id] = 0.0
+            for p in postings:
+                idf = math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+                for id in scores:
+                    tf = p[id]
+                    norm = 1 - self.b + self.b * self._lengths[id] / average
+                    scores[id] -= idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        results = sorted(((score, id) for id, score in scores.items()),
+                         key=lambda r: (r[0], -r[1]))
+        return after_cursor(results, after)[:limit]
+
+    def reindex(self, conn):
+        self.clear()
+        self.load(conn)
+        return len(self._lengths)
+
+
+class SearchIndex(object):
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        name = app.config['SEARCH_BACKEND']
+        if name == 'auto':
+            uri = app.config['SQLALCHEMY_DATABASE_URI']
+            name = 'fts5' if uri.startswith('sqlite') else 'memory'
+        if name == 'fts5':
+            self.backend = FTS5Backend()
+        elif name == 'memory':
+            self.backend = MemoryIndex()
+        else:
+            raise ValueError('Unknown SEARCH_BACKEND: {}'.format(name))
+
+    def add(self, conn, id, body):
+        self.backend.add(conn, id, body)
+
+    def remove(self, conn, id, body):
+        self.backend.remove(conn, id, body)
+
+    def search(self, conn, expression, limit, after=None):
+        """
+        Up to limit (score, post id) pairs matching every word of
+        expression, best first, starting after the (score, id) cursor.
+        """
+        words = terms(expression)
+        if not words:
+            return []
+        return self.backend.search(conn, words, limit, after)
+
+    def reindex(self, conn):
+        """Rebuild the index from the post table; returns the post count."""
+        return self.backend.reindex(conn)
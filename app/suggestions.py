@@ -0,0 +1,193 @@
+from datetime import datetime
+from itertools import chain
+from time import perf_counter
+import numpy as np
+from scipy import sparse
+from app import db
+from app.models import User, followers, suggestion, suggestion_state
+
+"""
+Offline "who to follow" suggestions, used by 'flask suggestions compute'.
+
+The whole follow graph is loaded into a sparse adjacency matrix A, where
+A[u, v] = 1 if u follows v. Row u of A @ A then counts, for every user v,
+how many of the users u follows follow v (common neighbours). Users u
+already follows and u themselves are removed, and the top k of what is
+left are written to the suggestion table. Ties go to the user with more
+followers.
+
+The job is incremental. A user's suggestions only depend on whom they
+follow and whom those users follow. So for every user we store two
+hashes: one of the set of users they follow, and one of those users'
+own hashes (their neighbourhood). The next run recomputes only the users
+for whom either hash has changed. Being followed doesn't change a user's
+hashes, so a popular user gaining followers doesn't invalidate all of
+their followers. Both hashes are sums, which are cheap to compute for
+every user from the matrix on each run.
+
+Users are processed BATCH at a time: one sparse product, and one
+transaction replacing their suggestions. Hashes are those of the graph as
+it was loaded, so follows made while the job runs are picked up by the
+next run.
+"""
+
+BATCH = 500
+
+
+def _fetch(statement, columns):
+    """
+    The rows of an all-integer select as an array. Reading the DBAPI
+    cursor directly is many times faster than building result rows.
+    """
+    result = db.session.execute(statement)
+    try:
+        return np.fromiter(chain.from_iterable(result.cursor),
+                           dtype=np.int64).reshape(-1, columns)
+    finally:
+        result.close()
+
+
+def load_graph():
+    """
+    Returns the user ids (sorted) and the adjacency matrix, indexed by
+    position in ids.
+    """
+    ids = _fetch(db.select([User.id]).order_by(User.id), 1)[:, 0]
+    edges = _fetch(db.select([followers.c.follower_id,
+                              followers.c.followed_id]), 2)
+    n = len(ids)
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(edges), dtype=np.int32),
+         (np.searchsorted(ids, edges[:, 0]), np.searchsorted(ids, edges[:, 1]))),
+        shape=(n, n))
+    return ids, adjacency
+
+
+def _mix(values):
+    # splitmix64's finalizer; uint64 arithmetic wraps around
+    values = values.astype(np.uint64)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94d049bb133111eb)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def _row_sums(adjacency, values):
+    # sum of values over every row's columns, modulo 2**64
+    sums = np.concatenate([[np.uint64(0)], np.cumsum(
+        values[adjacency.indices], dtype=np.uint64)])
+    return sums[adjacency.indptr[1:]] - sums[adjacency.indptr[:-1]]
+
+
+def neighborhood_hashes(ids, adjacency):
+    """
+    For every user, a hash of the set of users they follow and a hash of
+    those users' own hashes, as signed 64-bit ints (what the database
+    stores).
+    """
+    with np.errstate(over='ignore'):
+        followed = _row_sums(adjacency, _mix(ids))
+        neighborhood = _row_sums(adjacency, _mix(followed))
+    return followed.view(np.int64), neighborhood.view(np.int64)
+
+
+def stale_users(ids, followed, neighborhood):
+    """
+    Positions of the users whose stored hashes differ from the current
+    ones, or who have never been computed.
+    """
+    stale = np.ones(len(ids), dtype=bool)
+    stored = _fetch(db.select([
+        suggestion_state.c.user_id, suggestion_state.c.followed_hash,
+        suggestion_state.c.neighborhood_hash]), 3)
+    if len(ids) and len(stored):
+        index = np.minimum(np.searchsorted(ids, stored[:, 0]), len(ids) - 1)
+        known = ids[index] == stored[:, 0]
+        index, stored = index[known], stored[known]
+        stale[index] = (followed[index] != stored[:, 1]) | \
+            (neighborhood[index] != stored[:, 2])
+    return np.flatnonzero(stale)
+
+
+def top_suggestions(adjacency, rows, popularity, k):
+    """
+    For each position in rows, a list of up to k (position, score) pairs.
+    popularity breaks ties between equal scores.
+    """
+    sub = adjacency[rows]
+    scores = (sub @ adjacency).tocsr()
+    # drop the users already followed and the user themselves
+    known = sub + sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (np.arange(len(rows)), rows)),
+        shape=sub.shape)
+    scores = scores - scores.multiply(known > 0)
+    scores.eliminate_zeros()
+    scores = scores.tocsr()
+    # popularity is scaled below 1, so it only orders equal scores
+    tiebreak = popularity / (popularity.max() + 1.0) if len(popularity) else \
+        popularity
+    result = []
+    for i in range(len(rows)):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        columns = scores.indices[start:end]
+        values = scores.data[start:end]
+        key = values + tiebreak[columns]
+        if len(key) > k:
+            best = np.argpartition(-key, k - 1)[:k]
+            best = best[np.argsort(-key[best])]
+        else:
+            best = np.argsort(-key)
+        result.append([(columns[j], int(values[j])) for j in best])
+    return result
+
+
+def compute_suggestions(k=10, full=False, progress=None):
+    """
+    Recompute the suggestions of every user whose neighbourhood changed
+    since the last run, or of everyone if full is set.
+    progress(users, seconds) is called after each committed batch.
+    Returns a dict of counts and timings.
+    """
+    start = perf_counter()
+    ids, adjacency = load_graph()
+    followed, neighborhood = neighborhood_hashes(ids, adjacency)
+    if full:
+        db.session.execute(suggestion.delete())
+        db.session.execute(suggestion_state.delete())
+        db.session.commit()
+        rows = np.arange(len(ids))
+    else:
+        rows = stale_users(ids, followed, neighborhood)
+    loaded = perf_counter()
+    popularity = np.asarray(adjacency.sum(axis=0)).ravel().astype(np.float64)
+    now = datetime.utcnow()
+    written = 0
+    for offset in range(0, len(rows), BATCH):
+        batch = rows[offset:offset + BATCH]
+        batch_ids = [int(ids[i]) for i in batch]
+        entries = []
+        for user_id, top in zip(batch_ids, top_suggestions(
+                adjacency, batch, popularity, k)):
+            entries.extend({'user_id': user_id, 'rank': rank,
+                            'suggested_id': int(ids[j]), 'score': score}
+                           for rank, (j, score) in enumerate(top))
+        db.session.execute(suggestion.delete().where(
+            suggestion.c.user_id.in_(batch_ids)))
+        db.session.execute(suggestion_state.delete().where(
+            suggestion_state.c.user_id.in_(batch_ids)))
+        if entries:
+            db.session.execute(suggestion.insert(), entries)
+        db.session.execute(suggestion_state.insert(), [
+            {'user_id': user_id, 'followed_hash': int(followed[i]),
+             'neighborhood_hash': int(neighborhood[i]), 'computed': now}
+            for user_id, i in zip(batch_ids, batch)])
+        db.session.commit()
+        written += len(entries)
+        if progress is not None:
+            progress(offset + len(batch), perf_counter() - start)
+    return {'users': len(ids), 'follows': int(adjacency.nnz),
+            'computed': len(rows), 'suggestions': written,
+            'load_seconds': round(loaded - start, 3),
+            'seconds': round(perf_counter() - start, 3)}
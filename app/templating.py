@@ -0,0 +1,71 @@
+import os
+import tempfile
+from time import perf_counter
+from jinja2 import FileSystemBytecodeCache
+
+"""
+Template compilation for worker cold starts.
+
+Jinja compiles every template from source the first time a process
+renders it, so the first requests of a new worker pay for compiling
+base.html, bootstrap/base.html, index.html, _post.html, ... With a
+TEMPLATE_CACHE_DIR, the compiled bytecode is written to disk and every
+later worker loads it from there instead. Entries are keyed by template
+and checked against a checksum of the source, so an edited template is
+compiled again. The directory can be shared by all workers on a machine.
+
+With TEMPLATE_WARMUP, every template the app can find (ours and
+Flask-Bootstrap's) is loaded when the app is created, so no request has
+to wait for it. warmed and warmup_seconds record what that took.
+"""
+
+class FileBytecodeCache(FileSystemBytecodeCache):
+    """
+    Writes every file under a temporary name and renames it into place,
+    so that a worker never reads another one's half written file.
+    """
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(filename),
+                                   suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, filename)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+class TemplateCache(object):
+
+    def __init__(self, app=None):
+        self.warmed = 0
+        self.warmup_seconds = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Call this last in create_app(), when every blueprint (and so every
+        template folder) is registered.
+        """
+        if app.config['TEMPLATE_CACHE_ENABLED']:
+            directory = app.config['TEMPLATE_CACHE_DIR']
+            if not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileBytecodeCache(directory)
+        if app.config['TEMPLATE_WARMUP']:
+            self.warm_up(app)
+
+    def warm_up(self, app):
+        """Load (and compile, if need be) every template of the app."""
+        start = perf_counter()
+        names = app.jinja_env.list_templates()
+        for name in names:
+            app.jinja_env.get_template(name)
+        self.warmed = len(names)
+        self.warmup_seconds = perf_counter() - start
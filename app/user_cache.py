@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from sqlalchemy.orm import make_transient_to_detached
+from app import db
+
+"""
+Identity cache for the login manager's user_loader.
+
+Flask-Login loads the current user on every authenticated request. The
+cache keeps a snapshot of each recently seen user's columns (not the ORM
+object itself, which belongs to the session of one request) for
+USER_CACHE_TTL seconds. On a hit, a User is rebuilt from the snapshot and
+attached to the current session without a SELECT.
+
+Views that change a user row call invalidate() after committing. The TTL
+bounds how stale other workers' copies can get.
+"""
+
+class UserCache(object):
+
+    def __init__(self, model, app=None):
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.size = app.config['USER_CACHE_SIZE']
+
+    def load(self, id):
+        """
+        The user with this id, attached to the current session, or None.
+        """
+        now = time()
+        with self._lock:
+            entry = self._data.get(id)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(id)
+                self.hits += 1
+                values = entry[1]
+            else:
+                self.misses += 1
+                values = None
+        if values is None:
+            user = self.model.query.get(id)
+            if user is not None:
+                self.put(user)
+            return user
+        user = self.model(**values)
+        # mark the rebuilt object as a clean copy of the stored row, so
+        # that merging it into the session doesn't query or write anything.
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def put(self, user):
+        values = dict((attr.key, getattr(user, attr.key))
+                      for attr in self.model.__mapper__.column_attrs)
+        with self._lock:
+            self._data[user.id] = (time() + self.ttl, values)
+            self._data.move_to_end(user.id)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *ids):
+        with self._lock:
+            for id in ids:
+                self._data.pop(id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
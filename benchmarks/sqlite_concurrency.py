@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models import User, Post
+from config import Config
+
+"""
+Read throughput on a SQLite file while writers are active.
+
+Runs the same workload against a fresh database twice: once with SQLite's
+and Flask-SQLAlchemy's defaults (rollback journal, no pool) and once with
+the engine profile from config.py (WAL, pragmas, pooled connections).
+Readers load home timelines; writers publish posts and update last_seen.
+
+    $ python benchmarks/sqlite_concurrency.py --readers 4 --writers 2
+"""
+
+
+class BenchConfig(Config):
+    TESTING = True
+    PASSWORD_HASH_WORKERS = 0
+    LAST_SEEN_FLUSH_SIZE = 1000000
+
+
+class DefaultProfile(BenchConfig):
+    DATABASE_POOL_SIZE = 0
+    SQLITE_JOURNAL_MODE = None
+    SQLITE_SYNCHRONOUS = None
+    SQLITE_CACHE_SIZE = None
+    SQLITE_MMAP_SIZE = None
+    SQLITE_BUSY_TIMEOUT = None
+
+
+class TunedProfile(BenchConfig):
+    pass
+
+
+def populate(n_users, follows, posts):
+    users = [User(username='user%d' % i, email='user%d@example.com' % i)
+             for i in range(n_users)]
+    db.session.add_all(users)
+    db.session.commit()
+    for u in users:
+        for other in random.sample(users, follows):
+            if other is not u and not u.is_following(other):
+                u.follow(other)
+    db.session.commit()
+    for i in range(posts):
+        db.session.add(Post(body='post %d' % i, author=random.choice(users)))
+    db.session.commit()
+    return [u.id for u in users]
+
+
+def reader(app, user_ids, stop, stats):
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                user = User.query.get(random.choice(user_ids))
+                user.followed_posts().limit(10).all()
+            except OperationalError:
+                stats['errors'] += 1
+            else:
+                stats['latencies'].append(time.perf_counter() - start)
+            db.session.remove()
+
+
+def writer(app, user_ids, stop, stats):
+    with app.app_context():
+        while not stop.is_set():
+            user_id = random.choice(user_ids)
+            try:
+                db.session.add(Post(body='new', user_id=user_id,
+                                    timestamp=datetime.utcnow()))
+                db.session.execute(User.__table__.update().where(
+                    User.id == user_id).values(last_seen=datetime.utcnow()))
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                stats['errors'] += 1
+            else:
+                stats['writes'] += 1
+            db.session.remove()
+
+
+def run(config_class, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        class Profile(config_class):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp, 'app.db')
+        app = create_app(Profile)
+        with app.app_context():
+            db.create_all()
+            random.seed(1)
+            user_ids = populate(args.users, args.follows, args.posts)
+            journal = db.session.execute('PRAGMA journal_mode').scalar()
+            db.session.remove()
+
+        stop = threading.Event()
+        reads = [{'latencies': [], 'errors': 0} for _ in range(args.readers)]
+        writes = [{'writes': 0, 'errors': 0} for _ in range(args.writers)]
+        threads = [threading.Thread(target=reader, args=(app, user_ids, stop, s))
+                   for s in reads]
+        threads += [threading.Thread(target=writer, args=(app, user_ids, stop, s))
+                    for s in writes]
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+        with app.app_context():
+            db.get_engine(app).dispose()
+
+    latencies = sorted(l for s in reads for l in s['latencies'])
+    def percentile(p):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    return {
+        'journal_mode': journal,
+        'reads_per_sec': len(latencies) / args.duration,
+        'writes_per_sec': sum(s['writes'] for s in writes) / args.duration,
+        'read_p50_ms': percentile(0.50),
+        'read_p99_ms': percentile(0.99),
+        'errors': sum(s['errors'] for s in reads + writes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite concurrency benchmark.')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--follows', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=5000)
+    args = parser.parse_args()
+    report = {'default': run(DefaultProfile, args),
+              'tuned': run(TunedProfile, args)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
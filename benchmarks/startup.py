@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+"""
+Cold start benchmark: how long a fresh interpreter takes to import the app
+package and to get a ready-to-serve application out of it.
+
+Every sample runs in a new process so nothing is already in sys.modules.
+Point --baseline at another checkout (e.g. 'git worktree add /tmp/base
+<commit>') to compare against a tree where everything was built at import.
+
+It also reports the time to first byte of a new worker: from the start of
+the import to the response of its first request, the home page of a
+logged in user, which renders base.html, bootstrap/base.html, index.html
+and _post.html. That is measured for the current tree in three setups
+(see app/templating.py):
+
+    no_cache      templates compiled from source on first use
+    cache         bytecode loaded from a TEMPLATE_CACHE_DIR left by an
+                  earlier worker
+    cache_warmup  the same, with all templates loaded by create_app()
+                  (TEMPLATE_WARMUP)
+
+    $ python benchmarks/startup.py
+    $ python benchmarks/startup.py --baseline /tmp/base --runs 20
+"""
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside the child process. Trees with create_app() build the app
+# explicitly; older trees already built it as a side effect of the import.
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app as package
+t1 = time.perf_counter()
+if hasattr(package, 'create_app'):
+    package.create_app()
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1}))
+"""
+
+# Fills the database of the first request probe.
+PREPARE = """
+from app import create_app, db, template_cache
+from app.models import User, Post
+app = create_app()
+# compiles every template into TEMPLATE_CACHE_DIR, as an earlier worker
+template_cache.warm_up(app)
+with app.app_context():
+    db.create_all()
+    users = [User(username='user%d' % i, email='user%d@example.com' % i)
+             for i in range(5)]
+    db.session.add_all(users)
+    for i in range(50):
+        db.session.add(Post(body='post %d' % i, author=users[i % 5]))
+    for user in users[1:]:
+        users[0].follow(user)
+    db.session.commit()
+"""
+
+# A new worker: build the app and serve one request as user 1.
+FIRST_REQUEST_PROBE = """
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+app = create_app()
+t1 = time.perf_counter()
+client = app.test_client()
+with client.session_transaction() as session:
+    session['_user_id'] = '1'
+t2 = time.perf_counter()
+response = client.get('/index')
+t3 = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'ready': t1 - t0, 'first_request': t3 - t2,
+                  'ttfb': (t1 - t0) + (t3 - t2)}))
+"""
+
+FIRST_REQUEST_SETUPS = {
+    'no_cache': {'TEMPLATE_CACHE_DISABLED': '1'},
+    'cache': {},
+    'cache_warmup': {'TEMPLATE_WARMUP': '1'},
+}
+
+
+def sample(tree):
+    env = dict(os.environ)
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(tree, runs):
+    samples = [sample(tree) for _ in range(runs)]
+    result = {}
+    for key in ('import', 'create_app'):
+        values = [s[key] * 1000 for s in samples]
+        result[key] = {'median_ms': statistics.median(values),
+                       'min_ms': min(values)}
+    total = [(s['import'] + s['create_app']) * 1000 for s in samples]
+    result['total'] = {'median_ms': statistics.median(total),
+                       'min_ms': min(total)}
+    return result
+
+
+def measure_first_request(tree, runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.pop('FLASK_RUN_FROM_CLI', None)
+        env.update({'DATABASE_URL': 'sqlite:///' + os.path.join(tmp, 'app.db'),
+                    'LOG_DIR': os.path.join(tmp, 'logs'),
+                    'TEMPLATE_CACHE_DIR': os.path.join(tmp, 'templates')})
+        for name in ('TEMPLATE_CACHE_DISABLED', 'TEMPLATE_WARMUP'):
+            env.pop(name, None)
+        subprocess.run([sys.executable, '-c', PREPARE], cwd=tree, env=env,
+                       check=True, capture_output=True)
+        result = {}
+        for setup, overrides in FIRST_REQUEST_SETUPS.items():
+            samples = []
+            for _ in range(runs):
+                out = subprocess.run(
+                    [sys.executable, '-c', FIRST_REQUEST_PROBE], cwd=tree,
+                    env=dict(env, **overrides), check=True,
+                    capture_output=True, text=True).stdout
+                samples.append(json.loads(out.strip().splitlines()[-1]))
+            result[setup] = {key + '_ms': statistics.median(
+                s[key] * 1000 for s in samples)
+                for key in ('ready', 'first_request', 'ttfb')}
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark.')
+    parser.add_argument('--tree', default=os.path.dirname(here),
+                        help='checkout to measure (default: this one)')
+    parser.add_argument('--baseline', help='checkout to compare against')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    report = {'current': measure(args.tree, args.runs)}
+    if args.baseline:
+        report['baseline'] = measure(args.baseline, args.runs)
+        report['speedup'] = (report['baseline']['total']['median_ms'] /
+                             report['current']['total']['median_ms'])
+    report['first_request'] = measure_first_request(args.tree, args.runs)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
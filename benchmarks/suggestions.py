@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from app import create_app, db, last_seen
+from app.bulk import insert_rows
+from app.models import User, followers, repair_counters
+from app.suggestions import compute_suggestions
+from timelines import BenchConfig, generate_graph, commit_id
+
+"""
+Runtime of the "who to follow" batch job (app/suggestions.py) on the
+synthetic power-law graphs of benchmarks/timelines.py.
+
+For every --users size it builds the graph, then reports as JSON:
+
+    full         a first run, computing every user
+    incremental  a run after --changes random users have followed someone
+                 (picked by popularity, like the graph's own follows)
+
+    $ python benchmarks/suggestions.py --users 10000 100000
+"""
+
+
+def populate(rng, users, follows):
+    edge_from, edge_to, _ = generate_graph(rng, users, follows, 0)
+    insert_rows(User.__table__, ({
+        'id': i + 1, 'username': 'user%d' % i,
+        'email': 'user%d@example.com' % i, 'graph_version': 0}
+        for i in range(users)))
+    insert_rows(followers, ({'follower_id': int(a) + 1, 'followed_id': int(b) + 1}
+                            for a, b in zip(edge_from, edge_to)))
+    repair_counters()
+    return {'users': users, 'follows': len(edge_from),
+            'max_followers': int(np.bincount(edge_to).max()),
+            'max_following': int(np.bincount(edge_from).max())}
+
+
+def change_graph(rng, users, changes):
+    popularity = np.array([count for count, in db.session.query(
+        User.follower_count).order_by(User.id)], dtype=np.float64) + 1
+    targets = rng.choice(users, size=changes, p=popularity / popularity.sum())
+    for source, target in zip(rng.choice(users, size=changes, replace=False),
+                              targets):
+        if source != target:
+            User.query.get(int(source) + 1).follow(User.query.get(int(target) + 1))
+    db.session.commit()
+
+
+def run(args, users, tmp):
+    class Bench(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+            tmp, 'suggestions%d.db' % users)
+    app = create_app(Bench)
+    rng = np.random.default_rng(args.seed)
+    with app.app_context():
+        db.create_all()
+        report = {'graph': populate(rng, users, args.follows)}
+        report['full'] = compute_suggestions(args.k, full=True)
+        changes = args.changes or max(users // 100, 1)
+        change_graph(rng, users, changes)
+        report['incremental'] = dict(compute_suggestions(args.k),
+                                     changes=changes)
+        db.session.remove()
+        last_seen.flush()
+        db.get_engine(app).dispose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='"Who to follow" batch job benchmark.')
+    parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--follows', type=float, default=20,
+                        help='mean number of users each user follows')
+    parser.add_argument('--changes', type=int,
+                        help='follows between the two runs (default: 1%% '
+                             'of the users)')
+    parser.add_argument('-k', type=int, default=10,
+                        help='suggestions kept per user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON here, not stdout')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in args.users:
+            results.append(run(args, users, tmp))
+    text = json.dumps({'commit': commit_id(), 'seed': args.seed, 'k': args.k,
+                       'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
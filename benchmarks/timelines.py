@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app import create_app, db, last_seen
+from app.bulk import insert_rows
+from app.models import User, Post, followers, gravatar_hash, \
+    rebuild_timelines, repair_counters
+from config import Config
+
+"""
+Timeline benchmark on a synthetic social graph.
+
+Builds a SQLite database with a power-law follow graph: out-degrees
+(how many users someone follows) and popularity (how likely someone is to
+be followed) are both Pareto distributed, and so are post volumes. Then it
+times the hot paths through the Flask test client and reports, per path,
+p50/p99/mean latency and the number of SQL statements per request as JSON:
+
+    followed_posts  User.followed_posts(), first page, no HTTP
+    index           GET /index of a logged in user
+    explore         GET /explore
+    user            GET /user/<username> of a random user
+    follow          POST /follow/<username>
+    login           POST /login (password check included)
+
+Run it on two commits with the same --seed and diff the JSON:
+
+    $ python benchmarks/timelines.py --users 10000 --output before.json
+"""
+
+PASSWORD = 'benchmark'
+
+
+class BenchConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+def generate_graph(rng, users, follows, posts):
+    """
+    Returns (followers, followed) edge arrays and the number of posts of
+    every user, as 0-based user indexes.
+    """
+    # Pareto with shape a has mean scale * a / (a - 1)
+    out_degree = (rng.pareto(2.0, users) + 1) * follows / 2.0
+    out_degree = np.minimum(out_degree.astype(np.int64), users - 1)
+    popularity = rng.pareto(1.5, users) + 1
+    targets = rng.choice(users, size=int(out_degree.sum()),
+                         p=popularity / popularity.sum())
+    sources = np.repeat(np.arange(users), out_degree)
+    keep = sources != targets
+    edges = np.unique(sources[keep] * users + targets[keep])
+    post_counts = ((rng.pareto(1.5, users) + 1) * posts / 3.0).astype(np.int64)
+    return edges // users, edges % users, post_counts
+
+
+def populate(rng, args):
+    edge_from, edge_to, post_counts = generate_graph(
+        rng, args.users, args.follows, args.posts)
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(
+        PASSWORD, method=BenchConfig.PASSWORD_HASH_METHOD)
+    insert_rows(User.__table__, ({
+        'id': i + 1, 'username': 'user%d' % i,
+        'email': 'user%d@example.com' % i, 'password_hash': password_hash,
+        'avatar_hash': gravatar_hash('user%d@example.com' % i),
+        'about_me': None, 'last_seen': now, 'follower_count': 0,
+        'followed_count': 0, 'post_count': 0, 'graph_version': 0}
+        for i in range(args.users)))
+    insert_rows(followers, ({'follower_id': int(a) + 1, 'followed_id': int(b) + 1}
+                            for a, b in zip(edge_from, edge_to)))
+    authors = np.repeat(np.arange(args.users), post_counts)
+    ages = rng.uniform(0, 30 * 86400, len(authors))
+    insert_rows(Post.__table__, ({
+        'body': 'post %d' % n, 'user_id': int(author) + 1,
+        'timestamp': now - timedelta(seconds=float(age))}
+        for n, (author, age) in enumerate(zip(authors, ages))))
+    timeline_rows = rebuild_timelines()
+    repair_counters()
+    return {'users': args.users, 'follows': len(edge_from),
+            'posts': len(authors), 'timeline_rows': timeline_rows,
+            'max_followers': int(np.bincount(edge_to).max()),
+            'max_posts': int(post_counts.max())}
+
+
+class StatementCounter(object):
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def measure(name, samples, counter, run, setup=None):
+    """
+    Call run() samples times, after one untimed warm-up call. If setup is
+    given, run(setup()) is timed instead, without the setup.
+    Returns latency and statement stats.
+    """
+    latencies = []
+    statements = []
+    for n in range(samples + 1):
+        arg = setup() if setup is not None else None
+        before = counter.count
+        start = time.perf_counter()
+        status = run(arg) if setup is not None else run()
+        if n == 0:
+            continue
+        latencies.append(time.perf_counter() - start)
+        statements.append(counter.count - before)
+        if isinstance(status, int) and status >= 400:
+            raise RuntimeError('{} returned {}'.format(name, status))
+        if status == 302 and name in ('index', 'explore', 'user'):
+            raise RuntimeError('{} redirected, not logged in?'.format(name))
+    latencies = np.array(latencies) * 1000
+    return {'samples': samples,
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+            'mean_ms': round(float(latencies.mean()), 3),
+            'queries_per_request': round(float(np.mean(statements)), 2)}
+
+
+def commit_id():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(args, tmp):
+    class Bench(BenchConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+    app = create_app(Bench)
+    rng = np.random.default_rng(args.seed)
+    with app.app_context():
+        db.create_all()
+        graph = populate(rng, args)
+    engine = db.get_engine(app)
+    counter = StatementCounter(engine)
+    per_page = app.config['POSTS_PER_PAGE']
+
+    def pick_user():
+        return 'user%d' % rng.integers(args.users)
+
+    # Requests are made without an app context of our own: Flask would
+    # reuse it, and with it the logged in user cached in g, for every
+    # request.
+    results = {}
+    # log in a pool of clients as random users; this doubles as the login
+    # benchmark
+    clients = []
+    def login():
+        client = app.test_client()
+        r = client.post('/login', data={'username': pick_user(),
+                                        'password': PASSWORD})
+        clients.append(client)
+        return r.status_code
+    results['login'] = measure('login', args.clients, counter, login)
+    def client():
+        return clients[rng.integers(len(clients))]
+
+    with app.app_context():
+        def random_user():
+            db.session.remove()
+            return User.query.get(int(rng.integers(args.users)) + 1)
+        results['followed_posts'] = measure(
+            'followed_posts', args.samples, counter,
+            lambda user: user.followed_posts().limit(per_page).all(),
+            setup=random_user)
+        db.session.remove()
+    results['index'] = measure('index', args.samples, counter,
+        lambda: client().get('/index').status_code)
+    results['explore'] = measure('explore', args.samples, counter,
+        lambda: client().get('/explore').status_code)
+    results['user'] = measure('user', args.samples, counter,
+        lambda: client().get('/user/' + pick_user()).status_code)
+    results['follow'] = measure('follow', args.samples, counter,
+        lambda: client().post('/follow/' + pick_user()).status_code)
+    last_seen.flush()
+    engine.dispose()
+    return graph, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timeline benchmark.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--follows', type=float, default=20,
+                        help='mean number of users each user follows')
+    parser.add_argument('--posts', type=float, default=5,
+                        help='mean number of posts per user')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=20,
+                        help='logged in test clients (and login samples)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON here, not stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        graph, results = run(args, tmp)
+    report = {'commit': commit_id(), 'seed': args.seed, 'graph': graph,
+              'results': results,
+              'seconds': round(time.perf_counter() - started, 1)}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
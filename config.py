@@ -7,6 +7,25 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
     'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # optional read replicas (comma separated URLs). Reads of GET requests
+    # go to a replica, except for a few seconds after the client wrote
+    # something, so that users always see their own changes.
+    SQLALCHEMY_REPLICAS = [url for url in
+        (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url]
+    REPLICA_READ_YOUR_WRITES = int(os.environ.get('REPLICA_READ_YOUR_WRITES') or 5)
+    # engine profile (see app/database.py). A pool size of 0 means a new
+    # connection per checkout (NullPool).
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_POOL_OVERFLOW = int(os.environ.get('DATABASE_POOL_OVERFLOW') or 10)
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE') or 3600)
+    # pragmas run on every new SQLite connection. WAL lets readers carry on
+    # while someone writes; NORMAL sync is safe in WAL mode (a power cut can
+    # only lose the last commits, not corrupt the file).
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -16000) # KiB
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 128 * 2**20)
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000) # ms
     # email
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -14,5 +33,80 @@ class Config(object):
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['mark.getrost805@gmail.com']
+    # outgoing mail queue (see app/email.py)
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 100)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 20)
+    MAIL_QUEUE_TIMEOUT = float(os.environ.get('MAIL_QUEUE_TIMEOUT') or 1)
+    # password hashing (see app/hashing.py)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or \
+    'pbkdf2:sha256:260000'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE') or 16)
+    PASSWORD_HASH_WAIT = float(os.environ.get('PASSWORD_HASH_WAIT') or 0.5)
+    # cache of logged in users' rows (see app/user_cache.py)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 30)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
     # posts per page
     POSTS_PER_PAGE = 10 # will go higher for final product.
+    # number of recent posts the explore page keeps in memory
+    FIREHOSE_SIZE = int(os.environ.get('FIREHOSE_SIZE') or 500)
+    # how often (seconds) it looks for posts made by other processes
+    FIREHOSE_TTL = float(os.environ.get('FIREHOSE_TTL') or 5)
+    # last_seen updates are written in bulk every INTERVAL seconds or
+    # as soon as SIZE users are pending, whichever comes first.
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    LAST_SEEN_FLUSH_SIZE = int(os.environ.get('LAST_SEEN_FLUSH_SIZE') or 500)
+    # rendered post cache: 'memory' (per process) or 'sqlite' (shared file)
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND') or 'memory'
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 5000)
+    FRAGMENT_CACHE_PATH = os.environ.get('FRAGMENT_CACHE_PATH') or \
+    os.path.join(basedir, 'cache', 'fragments.db')
+    # live home timeline over server-sent events (see app/live.py). The
+    # 'sqlite' broker shares new posts between the worker processes of one
+    # machine through LIVE_BROKER_PATH; 'memory' only suits a single worker.
+    LIVE_BROKER = os.environ.get('LIVE_BROKER') or 'memory'
+    LIVE_BROKER_PATH = os.environ.get('LIVE_BROKER_PATH') or \
+    os.path.join(basedir, 'cache', 'live.db')
+    LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL') or 0.5)
+    LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE') or 100)
+    LIVE_HEARTBEAT = float(os.environ.get('LIVE_HEARTBEAT') or 15)
+    LIVE_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_MAX_SUBSCRIBERS') or 100)
+    # full-text post search (see app/search.py): 'fts5' (SQLite only),
+    # 'memory' (per process) or 'auto' to pick fts5 whenever we're on SQLite
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'auto'
+    # "who to follow" (see app/suggestions.py): how many suggestions the
+    # batch job keeps per user, and how many the home and profile pages show
+    SUGGESTIONS_PER_USER = int(os.environ.get('SUGGESTIONS_PER_USER') or 10)
+    SUGGESTIONS_SHOWN = int(os.environ.get('SUGGESTIONS_SHOWN') or 5)
+    # request metrics on /metrics (see app/metrics.py). Requests slower than
+    # METRICS_SLOW_REQUEST seconds are logged with their SQL; 0 turns that off.
+    METRICS_ENABLED = os.environ.get('METRICS_DISABLED') is None
+    METRICS_SLOW_REQUEST = float(os.environ.get('METRICS_SLOW_REQUEST') or 0)
+    # response compression (see app/compression.py); COMPRESS_DISABLED
+    # leaves it to a proxy in front of us
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_DISABLED') is None
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 500) # bytes
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL') or 6) # gzip, 1-9
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY') or 4)
+    COMPRESS_MIMETYPES = ['text/html', 'text/plain', 'text/css',
+                          'text/event-stream', 'application/javascript',
+                          'application/json', 'application/x-ndjson']
+    # hashed static assets (see app/assets.py) are cached for this long
+    ASSETS_MAX_AGE = int(os.environ.get('ASSETS_MAX_AGE') or 365 * 86400)
+    # compiled templates are kept in TEMPLATE_CACHE_DIR for the next worker
+    # (see app/templating.py); TEMPLATE_WARMUP compiles them all when the
+    # app is created instead of on their first use.
+    TEMPLATE_CACHE_ENABLED = os.environ.get('TEMPLATE_CACHE_DISABLED') is None
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR') or \
+    os.path.join(basedir, 'cache', 'templates')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP') is not None
+    # logging (see app/log_pipeline.py): JSON lines in LOG_DIR, rotated at
+    # LOG_MAX_BYTES, and at most one email per distinct error every
+    # LOG_MAIL_INTERVAL seconds.
+    LOG_DIR = os.environ.get('LOG_DIR') or os.path.join(basedir, 'logs')
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES') or 10 * 2**20)
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 10)
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE') or 10000)
+    LOG_MAIL_INTERVAL = int(os.environ.get('LOG_MAIL_INTERVAL') or 300)
+    LOG_MAIL_TIMEOUT = float(os.environ.get('LOG_MAIL_TIMEOUT') or 5)
@@ -1,5 +1,8 @@
-from app import app, db
-from app.models import User, Post, followers
+from app import create_app, db, cli
+from app.models import User, Post, followers, timeline
+
+app = create_app()
+cli.register(app)
 
 @app.shell_context_processor
 def make_shell_context():
@@ -10,4 +13,5 @@ def make_shell_context():
     The keys in the dictionary that is returned are the strings we'll write in
     the shell when referencing our database models.
     """
-    return {'db': db, 'User': User, 'Post': Post, 'followers': followers}
+    return {'db': db, 'User': User, 'Post': Post, 'followers': followers,
+            'timeline': timeline}
@@ -1,8 +1,10 @@
 from flask_mail import Message
-from app import app
+from app import create_app
 from app import mail
+app = create_app()
 msg = Message('test subject', sender=app.config['ADMINS'][0],
     recipients=['your-email@example.com'])
 msg.body = 'text body'
 msg.html = '<h1>HTML body</h1>'
-mail.send(msg)
+with app.app_context():
+    mail.send(msg)
@@ -0,0 +1,33 @@
+"""post search index
+
+Revision ID: b5e17d0c9a42
+Revises: d9228c94a730
+Create Date: 2026-10-18 21:12:40.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e17d0c9a42'
+down_revision = 'd9228c94a730'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the FTS5 index of app/search.py; other databases use the in-process
+    # index, which needs no table
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    # IF NOT EXISTS: earlier versions created it on the first post
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING "
+               "fts5(body, content='post', content_rowid='id')")
+    op.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TABLE IF EXISTS post_fts')
@@ -0,0 +1,64 @@
+"""followers primary key, reverse index and user counters
+
+Revision ID: e4b0d6a5f3c1
+Revises: c7f1a9d23e84
+Create Date: 2026-10-18 11:36:05.417730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b0d6a5f3c1'
+down_revision = 'c7f1a9d23e84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can't add a primary key to an existing table, so the followers
+    # table is rebuilt. Duplicate and half-empty rows are dropped on the way.
+    op.create_table('followers_new',
+    sa.Column('follower_id', sa.Integer(), nullable=False),
+    sa.Column('followed_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('follower_id', 'followed_id')
+    )
+    op.execute('INSERT INTO followers_new (follower_id, followed_id) '
+               'SELECT DISTINCT follower_id, followed_id FROM followers '
+               'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL')
+    op.drop_table('followers')
+    op.rename_table('followers_new', 'followers')
+    op.create_index('ix_followers_followed_id_follower_id', 'followers', ['followed_id', 'follower_id'], unique=False)
+
+    op.add_column('user', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('user', sa.Column('followed_count', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('user', sa.Column('post_count', sa.Integer(), server_default='0', nullable=True))
+    op.execute('UPDATE "user" SET '
+               'follower_count = (SELECT count(*) FROM followers '
+               'WHERE followers.followed_id = "user".id), '
+               'followed_count = (SELECT count(*) FROM followers '
+               'WHERE followers.follower_id = "user".id), '
+               'post_count = (SELECT count(*) FROM post '
+               'WHERE post.user_id = "user".id)')
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('post_count')
+        batch_op.drop_column('followed_count')
+        batch_op.drop_column('follower_count')
+
+    op.drop_index('ix_followers_followed_id_follower_id', table_name='followers')
+    op.create_table('followers_old',
+    sa.Column('follower_id', sa.Integer(), nullable=True),
+    sa.Column('followed_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['follower_id'], ['user.id'], )
+    )
+    op.execute('INSERT INTO followers_old (follower_id, followed_id) '
+               'SELECT follower_id, followed_id FROM followers')
+    op.drop_table('followers')
+    op.rename_table('followers_old', 'followers')
@@ -1,8 +1,41 @@
 from datetime import datetime, timedelta
 import unittest
-from app import app, db
-from app.models import User, Post
+import time
+import json
+import io
+import gzip
+import re
+import zlib
+import logging
+from queue import Queue
+import os
+import subprocess
+import sys
+import tempfile
+from app import create_app, db, mail, password_hasher, recent_posts, \
+    fragment_cache, last_seen, search_index, metrics, live_hub, assets, \
+    template_cache
+from app.models import User, Post, timeline, rebuild_timelines, repair_counters
+from app.models import load_user, user_cache, followers
+from app.pagination import paginate_keyset, decode_cursor
+from app.firehose import RecentPosts
+from app.last_seen import LastSeenBuffer
+from app.email import MailQueue
+from app.hashing import HashingBusy
+from app.fragments import FragmentCache, MemoryBackend, SQLiteBackend
+from app.search import MemoryIndex
+from app.bulk import TABLES, export_table, import_table, sequence_reset
+from app.suggestions import compute_suggestions
+from app.live import SQLiteBroker
+from app.log_pipeline import LogPipeline, DropQueueHandler, \
+    RateLimitedSMTPHandler
+from config import Config
+from flask_mail import Message
+from werkzeug.security import generate_password_hash
 import numpy as np
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import QueuePool, StaticPool
 
 """
 This script will perform unit tests.
@@ -15,18 +48,32 @@ the tests run respectively.
 
 """
 
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://' # a temporary data base in memory
+    TEMPLATE_CACHE_ENABLED = False # keep the tests out of cache/templates
+
 class UserModelCase(unittest.TestCase):
 
         def setUp(self):
             """
-            This sets up a temporary sql lite data base in memory for testing.
+            This builds an app with a temporary sql lite data base in memory
+            for testing.
             """
-            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+            self.app = create_app(TestConfig)
+            self.app_context = self.app.app_context()
+            self.app_context.push()
             db.create_all()
+            # process-wide caches must not carry over between tests
+            recent_posts.clear()
+            fragment_cache.backend.clear()
+            user_cache.clear()
 
         def tearDown(self):
+            last_seen.flush()
             db.session.remove()
             db.drop_all()
+            self.app_context.pop()
 
         # unit tests
         def test_password_hashing(self):
@@ -106,7 +153,1089 @@ class UserModelCase(unittest.TestCase):
             self.assertEqual(f1,[p4,p2,p1])
             self.assertEqual(f2,[p3,p2])
 
+        def test_timeline_fan_out(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            db.session.add_all([u1, u2])
+            db.session.commit()
+            now = datetime.utcnow()
+            p1 = Post(body='post from susan', author=u2,
+                timestamp=now + timedelta(seconds=1))
+            db.session.add(p1)
+            db.session.commit()
+
+            # following backfills susan's older posts into john's timeline
+            u1.follow(u2)
+            db.session.commit()
+            self.assertEqual(u1.followed_posts().all(), [p1])
+
+            # new posts are fanned out to followers on write
+            p2 = Post(body='second post from susan', author=u2,
+                timestamp=now + timedelta(seconds=2))
+            db.session.add(p2)
+            db.session.commit()
+            self.assertEqual(u1.followed_posts().all(), [p2, p1])
+
+            # rebuilding from scratch yields the same timelines
+            rebuild_timelines()
+            self.assertEqual(u1.followed_posts().all(), [p2, p1])
+            self.assertEqual(u2.followed_posts().all(), [p2, p1])
+
+            # unfollowing prunes susan's posts from john's timeline
+            u1.unfollow(u2)
+            db.session.commit()
+            self.assertEqual(u1.followed_posts().all(), [])
+            self.assertEqual(
+                db.session.query(timeline).filter_by(user_id=u1.id).count(), 0)
+
+
+        def test_keyset_pagination(self):
+            u = User(username='john', email='john@example.com')
+            db.session.add(u)
+            now = datetime.utcnow()
+            # two posts share a timestamp, so the id has to break the tie
+            posts = [Post(body='post {}'.format(i), author=u,
+                timestamp=now + timedelta(seconds=i // 2)) for i in range(5)]
+            db.session.add_all(posts)
+            db.session.commit()
+            newest_first = sorted(posts, key=lambda p: (p.timestamp, p.id),
+                reverse=True)
+
+            page1 = paginate_keyset(u.posts, Post.timestamp, Post.id, 2)
+            self.assertEqual(page1.items, newest_first[:2])
+            self.assertTrue(page1.has_next)
+            self.assertFalse(page1.has_prev)
+            page2 = paginate_keyset(u.posts, Post.timestamp, Post.id, 2,
+                before=page1.next_cursor)
+            self.assertEqual(page2.items, newest_first[2:4])
+            page3 = paginate_keyset(u.posts, Post.timestamp, Post.id, 2,
+                before=page2.next_cursor)
+            self.assertEqual(page3.items, newest_first[4:])
+            self.assertFalse(page3.has_next)
+
+            # walking back towards newer posts
+            back = paginate_keyset(u.posts, Post.timestamp, Post.id, 2,
+                after=page3.prev_cursor)
+            self.assertEqual(back.items, newest_first[2:4])
+            self.assertTrue(back.has_prev)
+
+            # garbage cursors fall back to the first page
+            self.assertIsNone(decode_cursor('not-a-cursor'))
+            self.assertEqual(paginate_keyset(u.posts, Post.timestamp, Post.id,
+                2, before='not-a-cursor').items, newest_first[:2])
+
+        def test_firehose_buffer(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            db.session.add_all([u1, u2])
+            now = datetime.utcnow()
+            posts = [Post(body='post {}'.format(i), author=[u1, u2][i % 2],
+                timestamp=now + timedelta(seconds=i)) for i in range(4)]
+            db.session.add_all(posts)
+            db.session.commit()
+
+            buffer = RecentPosts(maxlen=3, ttl=0)
+            page1 = buffer.page(2)
+            self.assertEqual([p.id for p in page1.items],
+                [posts[3].id, posts[2].id])
+            self.assertEqual(page1.items[0].author.username, 'susan')
+            # the next page reaches past the buffer: go to the data base
+            self.assertIsNone(buffer.page(2, before=page1.next_cursor))
+
+            # new posts go to the front of the buffer
+            p = Post(body='new post', author=u1,
+                timestamp=now + timedelta(seconds=10))
+            db.session.add(p)
+            db.session.commit()
+            buffer.add(p)
+            loads = []
+            load = buffer.load
+            buffer.load = lambda: loads.append(1) or load()
+            self.assertEqual(buffer.page(2).items[0].id, p.id)
+            # the database has nothing the buffer wasn't given
+            self.assertEqual(loads, [])
+
+            # profile changes show up in buffered posts
+            u2.username = 'mary'
+            db.session.commit()
+            buffer.update_author(u2)
+            self.assertEqual(buffer.page(2).items[1].author.username, 'mary')
+
+        def test_firehose_other_writers(self):
+            u = User(username='john', email='john@example.com')
+            u.set_password('cat')
+            db.session.add(u)
+            db.session.commit()
+            self.app.config['WTF_CSRF_ENABLED'] = False
+            ttl = recent_posts.ttl
+            try:
+                client = self.app.test_client()
+                client.post('/login', data={'username': 'john',
+                    'password': 'cat'})
+                client.post('/index', data={'post': 'through index'})
+                client.get('/explore') # shows the flashed message
+                response = client.get('/explore')
+                self.assertIn(b'through index', response.data)
+                # as if another worker or a bulk import wrote it
+                db.session.add(Post(body='from elsewhere', author=u))
+                db.session.commit()
+                etag = {'If-None-Match': response.headers['ETag']}
+                response = client.get('/explore', headers=etag)
+                self.assertEqual(response.status_code, 304) # within the ttl
+                recent_posts.ttl = 0
+                response = client.get('/explore', headers=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b'from elsewhere', response.data)
+                self.assertIn(b'through index', response.data)
+            finally:
+                recent_posts.ttl = ttl
+                self.app.config['WTF_CSRF_ENABLED'] = True
+
+        def test_timeline_query_count(self):
+            u = User(username='john', email='john@example.com')
+            authors = [User(username='user{}'.format(i),
+                email='user{}@example.com'.format(i)) for i in range(10)]
+            db.session.add_all([u] + authors)
+            db.session.commit()
+            for author in authors:
+                u.follow(author)
+                db.session.add(Post(body='hi', author=author))
+            db.session.commit()
+            user_id = u.id
+            db.session.remove()
+
+            statements = []
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                u = User.query.get(user_id)
+                posts = u.followed_posts().limit(10).all()
+                for post in posts:
+                    post.author.username, post.author.avatar(70)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(len(posts), 10)
+            # one query for the user, one for the page of posts and authors
+            self.assertEqual(len(statements), 2)
+            self.assertEqual(u.avatar_hash, 'd4c74594d841139328695756648b6bd6')
+
+        def test_last_seen_buffer(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            db.session.add_all([u1, u2])
+            db.session.commit()
+            buffer = LastSeenBuffer()
+            buffer.app = self.app
+            buffer.interval = 3600
+            buffer.size = 2
+            seen = datetime(2021, 3, 1, 12, 0, 0)
+
+            # below the size threshold nothing is written yet
+            buffer.touch(u1.id, seen)
+            db.session.expire_all()
+            self.assertNotEqual(u1.last_seen, seen)
+
+            # the second user reaches the threshold and both are written
+            buffer.touch(u2.id, seen)
+            db.session.expire_all()
+            self.assertEqual(u1.last_seen, seen)
+            self.assertEqual(u2.last_seen, seen)
+            self.assertEqual(buffer.flush(), 0)
+
+        def test_counters(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            u3 = User(username='mary', email='mary@example.com')
+            db.session.add_all([u1, u2, u3])
+            db.session.commit()
+            self.assertEqual((u1.follower_count, u1.followed_count,
+                u1.post_count), (0, 0, 0))
+
+            u1.follow(u2)
+            u1.follow(u3)
+            u3.follow(u2)
+            db.session.add_all([Post(body='one', author=u2),
+                Post(body='two', author=u2)])
+            db.session.commit()
+            self.assertEqual(u1.followed_count, 2)
+            self.assertEqual(u2.follower_count, 2)
+            self.assertEqual(u2.post_count, 2)
+
+            u1.unfollow(u2)
+            db.session.commit()
+            self.assertEqual(u1.followed_count, 1)
+            self.assertEqual(u2.follower_count, 1)
+
+            # repair recomputes counters that drifted
+            u2.follower_count = 42
+            u2.post_count = 0
+            db.session.commit()
+            self.assertEqual(repair_counters(), 3)
+            self.assertEqual(u2.follower_count, 1)
+            self.assertEqual(u2.post_count, 2)
+            self.assertEqual(u3.followed_count, 1)
+
+        def test_followed_ids_cached(self):
+            u = User(username='john', email='john@example.com')
+            others = [User(username='user{}'.format(i),
+                email='user{}@example.com'.format(i)) for i in range(5)]
+            db.session.add_all([u] + others)
+            db.session.commit()
+            u.follow(others[0])
+            u.follow(others[1])
+            db.session.commit()
+
+            statements = []
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+            # reload the objects expired by the commit
+            [user.id for user in [u] + others]
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                following = [u.is_following(other) for other in others]
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(following, [True, True, False, False, False])
+            self.assertEqual(len(statements), 1)
+
+            # follow/unfollow keep the set current without reloading it
+            u.unfollow(others[0])
+            u.follow(others[2])
+            self.assertEqual(u.followed_ids(), {others[1].id, others[2].id})
+            db.session.commit()
+            self.assertEqual(u.followed_ids(), {others[1].id, others[2].id})
+
+        def test_mail_queue(self):
+            state = self.app.extensions['mail']
+            suppress, state.suppress = state.suppress, True
+            try:
+                queue = MailQueue(self.app)
+                with mail.record_messages() as outbox:
+                    for i in range(5):
+                        self.assertTrue(queue.put(Message('hello {}'.format(i),
+                            sender='admin@example.com',
+                            recipients=['john@example.com'])))
+                    queue.shutdown()
+                self.assertEqual(len(outbox), 5)
+                self.assertEqual(queue.sent, 5)
+
+                # one bad message doesn't take the rest of its batch down
+                queue = MailQueue(self.app)
+                messages = [Message('hello {}'.format(i),
+                    sender='admin@example.com',
+                    recipients=['john@example.com']) for i in range(3)]
+                messages[1].subject = 'bad\nheader' # refused by flask_mail
+                with mail.record_messages() as outbox:
+                    queue._send(messages)
+                self.assertEqual(len(outbox), 2)
+                self.assertEqual((queue.sent, queue.failed), (2, 1))
+
+                # with no worker to drain it, a full queue drops messages
+                queue = MailQueue(self.app)
+                queue.workers = 0
+                queue.timeout = 0
+                for i in range(self.app.config['MAIL_QUEUE_SIZE'] + 2):
+                    queue.put(Message('hello', sender='admin@example.com',
+                        recipients=['john@example.com']))
+                self.assertEqual(queue.dropped, 2)
+            finally:
+                state.suppress = suppress
+
+        def test_fragment_cache(self):
+            u = User(username='john', email='john@example.com')
+            p = Post(body='hello', author=u)
+            db.session.add_all([u, p])
+            db.session.commit()
+            backend = MemoryBackend(100)
+            gets = []
+            get = backend.get
+            backend.get = lambda key: gets.append(key) or get(key)
+            cache = FragmentCache(backend=backend)
+            with self.app.test_request_context():
+                html = cache.render_post(p)
+                self.assertIn('john', html)
+                # the author's version is only read once per request
+                self.assertEqual(cache.render_post(p), html)
+                self.assertEqual(gets.count('author:%d' % u.id), 1)
+                # a cached fragment is served even if the user changed...
+                u.username = 'johnny'
+                self.assertEqual(cache.render_post(p), html)
+                # ...until the author is invalidated
+                cache.invalidate_author(u.id)
+                self.assertIn('johnny', cache.render_post(p))
+
+        def test_fragment_backends(self):
+            memory = MemoryBackend(2)
+            memory.set('a', '1')
+            memory.set('b', '2')
+            memory.get('a')
+            memory.set('c', '3')
+            self.assertIsNone(memory.get('b')) # least recently used
+            self.assertEqual(memory.get('a'), '1')
+
+            with tempfile.TemporaryDirectory() as tmp:
+                shared = SQLiteBackend(10, os.path.join(tmp, 'fragments.db'))
+                shared.set('a', '1')
+                # a second backend on the same file sees the same fragments
+                other = SQLiteBackend(10, os.path.join(tmp, 'fragments.db'))
+                self.assertEqual(other.get('a'), '1')
+                # hits don't write, unless the last use is old
+                conn = other._connect()
+                writes = conn.total_changes
+                other.get('a')
+                self.assertEqual(conn.total_changes, writes)
+                with conn:
+                    conn.execute('UPDATE fragment SET used = used - ?',
+                                 (SQLiteBackend.TOUCH_INTERVAL + 1,))
+                other.get('a')
+                self.assertEqual(conn.total_changes, writes + 2)
+                other.clear()
+                self.assertIsNone(shared.get('a'))
+
+        def test_conditional_get(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            u1.set_password('cat')
+            db.session.add_all([u1, u2, Post(body='hi', author=u2)])
+            db.session.commit()
+            self.app.config['WTF_CSRF_ENABLED'] = False
+            try:
+                client = self.app.test_client()
+                client.post('/login', data={'username': 'john',
+                    'password': 'cat'})
+                for url in ['/index', '/explore', '/user/susan']:
+                    r = client.get(url)
+                    self.assertEqual(r.status_code, 200)
+                    etag = r.headers['ETag']
+                    r = client.get(url, headers={'If-None-Match': etag})
+                    self.assertEqual(r.status_code, 304)
+                    self.assertEqual(r.data, b'')
+
+                # a one second CSRF time limit still gives an epoch
+                limit = self.app.config.get('WTF_CSRF_TIME_LIMIT')
+                self.app.config['WTF_CSRF_TIME_LIMIT'] = 1
+                try:
+                    self.assertEqual(client.get('/explore').status_code, 200)
+                finally:
+                    self.app.config['WTF_CSRF_TIME_LIMIT'] = limit
+
+                # following susan changes the home page
+                r = client.get('/index')
+                etag = r.headers['ETag']
+                client.post('/follow/susan')
+                client.get('/user/susan') # consume the flashed message
+                r = client.get('/index', headers={'If-None-Match': etag})
+                self.assertEqual(r.status_code, 200)
+                self.assertIn(b'hi', r.data)
+
+                # so does a followed author changing their name
+                etags = {url: client.get(url).headers['ETag']
+                         for url in ['/index', '/explore']}
+                client.get('/logout')
+                u2.set_password('dog')
+                db.session.commit()
+                client.post('/login', data={'username': 'susan',
+                    'password': 'dog'})
+                client.post('/edit_profile', data={'username': 'suzy',
+                    'about_me': ''})
+                client.get('/logout')
+                client.post('/login', data={'username': 'john',
+                    'password': 'cat'})
+                client.get('/user/john') # consume any flashed message
+                for url, etag in etags.items():
+                    r = client.get(url, headers={'If-None-Match': etag})
+                    self.assertEqual(r.status_code, 200)
+                    self.assertIn(b'/user/suzy', r.data)
+            finally:
+                self.app.config['WTF_CSRF_ENABLED'] = True
+
+        def test_password_rehash(self):
+            u = User(username='susan', email='susan@example.com')
+            # a hash made with older, cheaper settings
+            u.password_hash = generate_password_hash('cat',
+                'pbkdf2:sha256:1000')
+            self.assertTrue(password_hasher.needs_rehash(u.password_hash))
+            self.assertFalse(u.check_password('dog'))
+            self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+            # a busy hasher doesn't fail a good login; the rehash waits
+            def busy(password):
+                raise HashingBusy()
+            password_hasher.generate = busy
+            try:
+                self.assertTrue(u.check_password('cat'))
+            finally:
+                del password_hasher.generate
+            self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(u.check_password('cat'))
+            self.assertFalse(password_hasher.needs_rehash(u.password_hash))
+            self.assertTrue(u.check_password('cat'))
+
+        def test_password_hashing_busy(self):
+            u = User(username='susan', email='susan@example.com')
+            u.set_password('cat')
+            db.session.add(u)
+            db.session.commit()
+            wait, password_hasher.wait = password_hasher.wait, 0
+            slots = self.app.config['PASSWORD_HASH_QUEUE']
+            for i in range(slots):
+                password_hasher.slots.acquire()
+            try:
+                self.assertRaises(HashingBusy, u.check_password, 'cat')
+                self.app.config['WTF_CSRF_ENABLED'] = False
+                r = self.app.test_client().post('/login', data={
+                    'username': 'susan', 'password': 'cat'})
+                self.assertEqual(r.status_code, 503)
+                self.assertEqual(r.headers['Retry-After'], '1')
+            finally:
+                self.app.config['WTF_CSRF_ENABLED'] = True
+                for i in range(slots):
+                    password_hasher.slots.release()
+                password_hasher.wait = wait
+
+        def test_user_cache(self):
+            u = User(username='john', email='john@example.com')
+            db.session.add(u)
+            db.session.commit()
+            user_id = u.id
+            db.session.remove()
+            hits, misses = user_cache.hits, user_cache.misses
+            self.assertEqual(load_user(str(user_id)).username, 'john')
+            self.assertEqual(user_cache.misses, misses + 1)
+            db.session.remove()
+
+            statements = []
+            def count(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                u = load_user(str(user_id))
+                self.assertEqual(u.username, 'john')
+                self.assertEqual(u.avatar_hash,
+                    'd4c74594d841139328695756648b6bd6')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(statements, [])
+            self.assertEqual(user_cache.hits, hits + 1)
+
+            # the cached user is attached to the session and can be changed
+            u.about_me = 'hello'
+            db.session.commit()
+            user_cache.invalidate(user_id)
+            db.session.remove()
+            self.assertEqual(load_user(str(user_id)).about_me, 'hello')
+            self.assertEqual(user_cache.misses, misses + 2)
+
+        def test_sqlite_engine_profile(self):
+            # in-memory databases keep their single shared connection
+            self.assertIsInstance(db.engine.pool, StaticPool)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                class FileConfig(TestConfig):
+                    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + \
+                        os.path.join(tmp, 'app.db')
+                app = create_app(FileConfig)
+                with app.app_context():
+                    engine = db.engine
+                    self.assertIsInstance(engine.pool, QueuePool)
+                    self.assertEqual(engine.pool.size(), 5)
+                    with engine.connect() as conn:
+                        def pragma(name):
+                            return conn.execute('PRAGMA ' + name).scalar()
+                        self.assertEqual(pragma('journal_mode'), 'wal')
+                        self.assertEqual(pragma('synchronous'), 1) # NORMAL
+                        self.assertEqual(pragma('cache_size'), -16000)
+                        self.assertEqual(pragma('busy_timeout'), 5000)
+                    engine.dispose()
+
+        def test_replica_routing(self):
+            with tempfile.TemporaryDirectory() as tmp:
+                class ReplicaConfig(TestConfig):
+                    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + \
+                        os.path.join(tmp, 'primary.db')
+                    SQLALCHEMY_REPLICAS = [
+                        'sqlite:///' + os.path.join(tmp, 'replica.db')]
+                app = create_app(ReplicaConfig)
+                with app.app_context():
+                    db.create_all()
+                    replica = db.get_engine(app, 'replica0')
+                    db.Model.metadata.create_all(replica)
+                    # the replica lags behind: it has an old copy of john
+                    db.session.add(User(username='john', email='john@x.com',
+                                        about_me='new'))
+                    db.session.commit()
+                    replica.execute(User.__table__.insert().values(
+                        id=1, username='john', email='john@x.com',
+                        about_me='old'))
+
+                    def about_me():
+                        db.session.remove()
+                        return User.query.get(1).about_me
+                    self.assertEqual(about_me(), 'new') # no request
+                    with app.test_request_context('/', method='POST'):
+                        self.assertEqual(about_me(), 'new')
+                    with app.test_request_context('/', method='GET'):
+                        self.assertEqual(about_me(), 'old')
+                        # writes go to the primary, and then so do reads
+                        u = User.query.get(1)
+                        u.about_me = 'newer'
+                        db.session.commit()
+                        self.assertEqual(about_me(), 'newer')
+                    self.assertEqual(about_me(), 'newer') # on the primary
+                    db.session.remove()
+                    for engine in (db.engine, replica):
+                        engine.dispose()
+
+        def test_post_search(self):
+            u = User(username='john', email='john@example.com')
+            db.session.add(u)
+            bodies = ['the quick brown fox', 'the lazy dog', 'quick quick dog',
+                      'a fox, a dog and a cat', 'nothing to see']
+            for i, body in enumerate(bodies):
+                db.session.add(Post(body=body, author=u,
+                    timestamp=datetime.utcnow() + timedelta(seconds=i)))
+            db.session.commit()
+            posts = {p.body: p.id for p in Post.query.all()}
+
+            def bodies_for(q, per_page=10):
+                page = Post.search(q, per_page)
+                found = [p.body for p in page.items]
+                while page.has_next:
+                    page = Post.search(q, per_page, after=page.next_cursor)
+                    found += [p.body for p in page.items]
+                return found
+
+            dogs = bodies_for('dog')
+            self.assertEqual(sorted(dogs), sorted(['the lazy dog',
+                'quick quick dog', 'a fox, a dog and a cat']))
+            self.assertEqual(bodies_for('dog', per_page=1), dogs)
+            self.assertEqual(bodies_for('QUICK dog'), ['quick quick dog'])
+            # the best match comes first
+            self.assertEqual(bodies_for('quick')[0], 'quick quick dog')
+            # query syntax is not passed through to FTS5
+            self.assertEqual(bodies_for('dog" (fox*'),
+                ['a fox, a dog and a cat'])
+            self.assertEqual(bodies_for('?!'), [])
+
+            self.assertEqual(search_index.reindex(db.session.connection()), 5)
+            self.assertEqual(sorted(bodies_for('dog')), sorted(dogs))
+
+            # the in-process index finds the same posts
+            memory = MemoryIndex()
+            conn = db.session.connection()
+            hits = memory.search(conn, ['dog'], 10)
+            self.assertEqual(sorted(id for score, id in hits),
+                             sorted(posts[body] for body in dogs))
+            self.assertEqual(memory.search(conn, ['dog'], 10, after=hits[0]),
+                             hits[1:])
+            self.assertEqual(memory.search(conn, ['quick'], 10)[0][1],
+                             posts['quick quick dog'])
+            memory.remove(conn, posts['the lazy dog'], 'the lazy dog')
+            self.assertEqual(len(memory.search(conn, ['dog'], 10)), 2)
+
+        def test_api_timelines(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            u1.set_password('cat')
+            db.session.add_all([u1, u2])
+            now = datetime.utcnow()
+            for i in range(25):
+                db.session.add(Post(body='post %d' % i, author=u2,
+                    timestamp=now + timedelta(seconds=i)))
+            u1.follow(u2)
+            db.session.commit()
+            self.app.config['WTF_CSRF_ENABLED'] = False
+            try:
+                client = self.app.test_client()
+                r = client.get('/api/timeline/home')
+                self.assertEqual(r.status_code, 401)
+                self.assertEqual(r.get_json()['error'], 'Unauthorized')
+                client.post('/login', data={'username': 'john',
+                    'password': 'cat'})
+
+                for url in ['/api/timeline/home', '/api/timeline/explore',
+                            '/api/users/susan/posts']:
+                    bodies = []
+                    while url:
+                        data = client.get(url + '&limit=10' if '?' in url
+                                          else url + '?limit=10').get_json()
+                        bodies += [p['body'] for p in data['items']]
+                        url = data['_links']['next']
+                    self.assertEqual(bodies,
+                        ['post %d' % i for i in reversed(range(25))])
+                item = client.get('/api/users/susan/posts').get_json()['items'][0]
+                self.assertEqual(item['author']['username'], 'susan')
+                self.assertTrue(item['timestamp'].endswith('Z'))
+                self.assertEqual(client.get('/api/users/nobody/posts').status_code,
+                                 404)
+
+                for url in ['/api/timeline/home.ndjson',
+                            '/api/timeline/explore.ndjson',
+                            '/api/users/susan/posts.ndjson']:
+                    r = client.get(url)
+                    self.assertEqual(r.mimetype, 'application/x-ndjson')
+                    self.assertTrue(r.is_streamed)
+                    lines = r.get_data(as_text=True).splitlines()
+                    self.assertEqual([json.loads(l)['body'] for l in lines],
+                        ['post %d' % i for i in reversed(range(25))])
+            finally:
+                self.app.config['WTF_CSRF_ENABLED'] = True
+
+        def test_migrate_extension(self):
+            # registered for every app, not just under the flask command
+            config = self.app.extensions['migrate'].migrate.get_config()
+            self.assertEqual(config.get_main_option('script_location'),
+                             'migrations')
+            # but building an app doesn't import alembic
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, DATABASE_URL='sqlite://',
+                           LOG_DIR=os.path.join(tmp, 'logs'))
+                env.pop('FLASK_RUN_FROM_CLI', None)
+                out = subprocess.run([sys.executable, '-c',
+                    'import sys; from app import create_app; create_app(); '
+                    'print("alembic" in sys.modules)'], env=env, check=True,
+                    capture_output=True, text=True,
+                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            self.assertEqual(out.strip().splitlines()[-1], 'False')
+
+        def test_bulk_export_import(self):
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            db.session.add_all([u1, u2])
+            for i in range(5):
+                db.session.add(Post(body='post %d' % i, author=u2))
+            u1.follow(u2)
+            db.session.commit()
+            exported = {}
+            for name, table in TABLES:
+                out = io.StringIO()
+                exported[name] = export_table(table, out)
+                out.seek(0)
+                exported[name] = (exported[name], out.getvalue())
+            self.assertEqual({name: count for name, (count, _)
+                              in exported.items()},
+                             {'users': 2, 'posts': 5, 'followers': 1})
+            rows = {name: db.session.query(table).all()
+                    for name, table in TABLES}
+
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+            calls = []
+            for name, table in TABLES:
+                count = import_table(table, exported[name][1].splitlines(),
+                                     chunk_size=2,
+                                     progress=lambda n, t: calls.append(n))
+                self.assertEqual(count, exported[name][0])
+                self.assertEqual(db.session.query(table).all(), rows[name])
+            self.assertEqual(calls, [2, 2, 4, 5, 1])
+            rebuild_timelines()
+            john = User.query.filter_by(username='john').first()
+            self.assertEqual(john.followed_posts().count(), 5)
+
+            # PostgreSQL's id sequences are moved past the imported ids
+            pg = postgresql.dialect()
+            sql = str(sequence_reset(User.__table__, pg).compile(dialect=pg))
+            self.assertIn('setval(pg_get_serial_sequence(', sql)
+            self.assertIn('max("user".id)', sql)
+            self.assertIsNone(sequence_reset(followers, pg))
+            self.assertIsNone(sequence_reset(User.__table__,
+                                             db.engine.dialect))
+
+        def test_suggestions(self):
+            names = ['john', 'susan', 'mary', 'david', 'anna', 'tom']
+            u = {}
+            for name in names:
+                u[name] = User(username=name, email=name + '@example.com')
+                u[name].set_password('cat')
+                db.session.add(u[name])
+            db.session.commit()
+            # john follows susan and anna; both follow mary, susan also
+            # follows david, and tom follows david too.
+            u['john'].follow(u['susan'])
+            u['john'].follow(u['anna'])
+            u['susan'].follow(u['mary'])
+            u['susan'].follow(u['david'])
+            u['anna'].follow(u['mary'])
+            u['tom'].follow(u['david'])
+            db.session.commit()
+
+            stats = compute_suggestions(k=10)
+            self.assertEqual(stats['users'], 6)
+            self.assertEqual(stats['computed'], 6)
+            self.assertEqual(
+                [(user.username, score)
+                 for user, score in u['john'].suggested_users(5)],
+                [('mary', 2), ('david', 1)])
+            # never ourselves or someone we already follow
+            self.assertEqual(u['susan'].suggested_users(5), [])
+            self.assertEqual(
+                [(user.username, score)
+                 for user, score in u['tom'].suggested_users(5)], [])
+            # nothing changed, nothing to do
+            self.assertEqual(compute_suggestions(k=10)['computed'], 0)
+
+            # anna follows tom: anna and john (who follows anna) have a new
+            # neighbourhood; being followed doesn't change tom's
+            u['anna'].follow(u['tom'])
+            db.session.commit()
+            stats = compute_suggestions(k=1)
+            self.assertEqual(stats['computed'], 2)
+            self.assertEqual(
+                [(user.username, score)
+                 for user, score in u['john'].suggested_users(5)],
+                [('mary', 2)])
+            self.assertEqual(compute_suggestions(k=10, full=True)['computed'], 6)
+
+            self.app.config['WTF_CSRF_ENABLED'] = False
+            try:
+                client = self.app.test_client()
+                client.post('/login', data={'username': 'john', 'password': 'cat'})
+                r = client.get('/index')
+                self.assertIn(b'<h4>Who to follow', r.data)
+                self.assertIn(b'/user/mary', r.data)
+                self.assertIn(b'<h4>Who to follow', client.get('/user/john').data)
+                self.assertNotIn(b'<h4>Who to follow', client.get('/user/susan').data)
+                # a follow hides the user right away, before the next run
+                u['john'].follow(u['mary'])
+                db.session.commit()
+                r = client.get('/index', headers={'If-None-Match': r.headers['ETag']})
+                self.assertEqual(r.status_code, 200)
+                self.assertNotIn(b'/user/mary', r.data.split(b'<h4>Who to follow')[1])
+            finally:
+                self.app.config['WTF_CSRF_ENABLED'] = True
+
+        def test_live_timeline(self):
+            john = User(username='john', email='john@example.com')
+            susan = User(username='susan', email='susan@example.com')
+            david = User(username='david', email='david@example.com')
+            john.set_password('cat')
+            db.session.add_all([john, susan, david])
+            john.follow(susan)
+            db.session.commit()
+            live_hub.heartbeat = 0.01
+
+            def publish(author, body):
+                post = Post(body=body, author=author)
+                db.session.add(post)
+                db.session.commit()
+                with self.app.test_request_context():
+                    live_hub.publish_post(post)
+
+            self.app.config['WTF_CSRF_ENABLED'] = False
+            try:
+                client = self.app.test_client()
+                client.post('/login', data={'username': 'john',
+                    'password': 'cat'})
+                self.assertIn(b'/index/live', client.get('/index').data)
+                r = client.get('/index/live', buffered=False)
+                self.assertEqual(r.mimetype, 'text/event-stream')
+                self.assertEqual(live_hub.subscribers, 1)
+                events = iter(r.response)
+                self.assertEqual(next(events), b': connected\n\n')
+                self.assertEqual(next(events), b': heartbeat\n\n')
+
+                # posts by the users we follow and our own, nobody else's
+                publish(david, 'not for john')
+                publish(susan, 'hello john')
+                event = next(events).decode()
+                self.assertTrue(event.startswith('id: 2\nevent: post\ndata: '))
+                self.assertIn('hello john', event)
+                self.assertTrue(all(line.startswith(('id:', 'event:', 'data:'))
+                                    for line in event.strip().split('\n')))
+                client.post('/index', data={'post': 'my own post'})
+                self.assertIn('my own post', next(events).decode())
+                # following david takes effect on the open stream
+                client.post('/follow/david')
+                publish(david, 'now for john')
+                self.assertIn('now for john', next(events).decode())
+
+                r2 = client.get('/index/live?format=json', buffered=False)
+                events2 = iter(r2.response)
+                next(events2)
+                publish(susan, 'as json')
+                data = next(events2).decode().split('data: ', 1)[1]
+                self.assertEqual(json.loads(data)['body'], 'as json')
+                self.assertEqual(json.loads(data)['author']['username'],
+                                 'susan')
+                self.assertIn('as json', next(events).decode())
+
+                r.close()
+                r2.close()
+                self.assertEqual(live_hub.subscribers, 0)
+                live_hub.max_subscribers = 0
+                self.assertEqual(client.get('/index/live').status_code, 503)
+            finally:
+                live_hub.max_subscribers = TestConfig.LIVE_MAX_SUBSCRIBERS
+                live_hub.heartbeat = TestConfig.LIVE_HEARTBEAT
+                self.app.config['WTF_CSRF_ENABLED'] = True
+
+            # a subscriber that falls behind is told to reload
+            live_hub.queue_size = 2
+            subscription = live_hub.subscribe(john.id, [susan.id])
+            live_hub.queue_size = TestConfig.LIVE_QUEUE_SIZE
+            dropped = live_hub.dropped
+            for i in range(3):
+                publish(susan, 'post %d' % i)
+            self.assertEqual(live_hub.dropped, dropped + 1)
+            events = live_hub.stream(subscription)
+            self.assertEqual(list(events)[1:], ['event: resync\ndata: {}\n\n'])
+            self.assertEqual(live_hub.subscribers, 0)
+
+        def test_live_sqlite_broker(self):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'live.db')
+                sender = SQLiteBroker(path, 0.01)
+                receiver = SQLiteBroker(path, 0.01)
+                sender.publish({'type': 'post', 'id': 1}) # before listening
+                received = []
+                receiver.start(received.append)
+                receiver.listen()
+                sender.publish({'type': 'post', 'id': 2})
+                for i in range(200):
+                    if received:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(received, [{'type': 'post', 'id': 2}])
+
+                # a failing delivery is logged, and polling goes on
+                def deliver(message):
+                    if message['id'] == 3:
+                        raise ValueError('bad message')
+                    received.append(message)
+                receiver.deliver = deliver
+                with self.assertLogs('app.live', 'ERROR'):
+                    sender.publish({'type': 'post', 'id': 3})
+                    sender.publish({'type': 'post', 'id': 4})
+                    for i in range(200):
+                        if len(received) > 1:
+                            break
+                        time.sleep(0.01)
+                receiver.stop()
+                self.assertEqual(received[1:], [{'type': 'post', 'id': 4}])
+
+        def test_compression(self):
+            u = User(username='john', email='john@example.com')
+            u.set_password('cat')
+            db.session.add(u)
+            for i in range(30):
+                db.session.add(Post(body='post number %d' % i, author=u))
+            db.session.commit()
+            gz = {'Accept-Encoding': 'gzip'}
+            self.app.config['WTF_CSRF_ENABLED'] = False
+            try:
+                client = self.app.test_client()
+                client.post('/login', data={'username': 'john',
+                    'password': 'cat'})
+                plain = client.get('/index')
+                self.assertNotIn('Content-Encoding', plain.headers)
+                self.assertIn('Accept-Encoding', plain.headers['Vary'])
+                r = client.get('/index', headers=gz)
+                self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(gzip.decompress(r.data), plain.data)
+                self.assertLess(len(r.data), len(plain.data))
+                etag, weak = r.get_etag()
+                self.assertTrue(weak)
+                r = client.get('/index', headers={'Accept-Encoding': 'gzip',
+                    'If-None-Match': r.headers['ETag']})
+                self.assertEqual(r.status_code, 304)
+
+                # streams are compressed on the fly; event streams chunk
+                # by chunk
+                r = client.get('/api/timeline/home.ndjson', headers=gz)
+                self.assertNotIn('Content-Length', r.headers)
+                self.assertEqual(len(gzip.decompress(r.data).splitlines()), 30)
+                r = client.get('/index/live', headers=gz, buffered=False)
+                decompressor = zlib.decompressobj(31)
+                self.assertEqual(decompressor.decompress(next(iter(
+                    r.response))), b': connected\n\n')
+                r.close()
+
+                # too small to bother
+                r = client.get('/api/timeline/home?limit=1', headers=gz)
+                self.assertLess(len(r.data), 500)
+                self.assertNotIn('Content-Encoding', r.headers)
+            finally:
+                self.app.config['WTF_CSRF_ENABLED'] = True
+
+        def test_assets(self):
+            client = self.app.test_client()
+            page = client.get('/login').get_data(as_text=True)
+            css = re.search(r'href="(/assets/css/bootstrap\.min\.\w{12}\.css)"',
+                            page).group(1)
+            self.assertRegex(page, r'src="/assets/jquery\.min\.\w{12}\.js"')
+            r = client.get(css, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+            self.assertIn('immutable', r.headers['Cache-Control'])
+            self.assertNotIn('Cookie', r.headers['Vary'])
+            # the fonts are referred to by their hashed names too
+            font = re.search(r'url\(\.\./(fonts/[^)?#]+\.woff2)\)',
+                             gzip.decompress(r.data).decode()).group(1)
+            r = client.get('/assets/' + font)
+            self.assertEqual(r.status_code, 200)
+            self.assertNotIn('Content-Encoding', r.headers) # no gain
+            r = client.get(css, headers={'Accept-Encoding': 'gzip',
+                                         'If-None-Match': r'"%s-gzip"' %
+                                         css.rsplit('.', 2)[1]})
+            self.assertEqual(r.status_code, 304)
+            self.assertIsNone(assets.url('no/such/file.js'))
+            self.assertEqual(client.get('/assets/css/bootstrap.min.css')
+                             .status_code, 404)
+
+        def test_template_cache(self):
+            with tempfile.TemporaryDirectory() as tmp:
+                class CachedConfig(TestConfig):
+                    TEMPLATE_CACHE_ENABLED = True
+                    TEMPLATE_CACHE_DIR = os.path.join(tmp, 'templates')
+                    TEMPLATE_WARMUP = True
+                def compiles(app):
+                    # how many templates app compiles from source
+                    calls = []
+                    compile = app.jinja_env.compile
+                    app.jinja_env.compile = \
+                        lambda *args, **kwargs: calls.append(1) or \
+                        compile(*args, **kwargs)
+                    return calls
+
+                app = create_app(CachedConfig)
+                self.assertIn('index.html', app.jinja_env.list_templates())
+                self.assertIn('bootstrap/base.html',
+                              app.jinja_env.list_templates())
+                self.assertEqual(template_cache.warmed,
+                                 len(app.jinja_env.list_templates()))
+                self.assertEqual(len(os.listdir(CachedConfig.TEMPLATE_CACHE_DIR)),
+                                 template_cache.warmed)
+                # warmed up: the first request doesn't compile anything
+                calls = compiles(app)
+                app.jinja_env.get_template('index.html')
+                self.assertEqual(calls, [])
+
+                # a new worker loads the bytecode instead of compiling
+                CachedConfig.TEMPLATE_WARMUP = False
+                app = create_app(CachedConfig)
+                calls = compiles(app)
+                template_cache.warm_up(app)
+                self.assertEqual(calls, [])
+                # but not for a template that has changed
+                app = create_app(CachedConfig)
+                calls = compiles(app)
+                get_source = app.jinja_env.loader.get_source
+                def edited(environment, name):
+                    source, filename, uptodate = get_source(environment, name)
+                    if name == 'index.html':
+                        source = '{# edited #}' + source
+                    return source, filename, uptodate
+                app.jinja_env.loader.get_source = edited
+                template_cache.warm_up(app)
+                self.assertEqual(len(calls), 1)
+            db.session.remove()
+
+        def test_metrics(self):
+            u = User(username='john', email='john@example.com')
+            u.set_password('cat')
+            db.session.add_all([u, Post(body='hi', author=u)])
+            db.session.commit()
+            metrics.clear()
+            client = self.app.test_client()
+            client.get('/login')
+            client.get('/login')
+            client.get('/no/such/page')
+            r = client.get('/metrics')
+            self.assertEqual(r.mimetype, 'text/plain')
+            text = r.get_data(as_text=True)
+            self.assertIn('microblog_requests_total{endpoint="auth.login",'
+                          'method="GET",status="200"} 2', text)
+            self.assertIn('microblog_requests_total{endpoint="none",'
+                          'method="GET",status="404"} 1', text)
+            self.assertIn('microblog_request_duration_seconds_count{'
+                          'endpoint="auth.login",method="GET"} 2', text)
+            self.assertIn('microblog_request_duration_seconds_bucket{'
+                          'endpoint="auth.login",method="GET",le="+Inf"} 2', text)
+            size = [line for line in text.splitlines() if line.startswith(
+                'microblog_response_size_bytes_sum{endpoint="auth.login"')]
+            self.assertGreater(float(size[0].split()[-1]), 0)
+            template = [line for line in text.splitlines() if line.startswith(
+                'microblog_request_template_seconds_sum{endpoint="auth.login"')]
+            self.assertGreater(float(template[0].split()[-1]), 0)
+
+            # SQL statements are counted, and logged for slow requests
+            metrics.slow_request = 1e-9
+            try:
+                with self.assertLogs(self.app.logger, 'WARNING') as logs:
+                    self.app.config['WTF_CSRF_ENABLED'] = False
+                    client.post('/login', data={'username': 'john',
+                                                'password': 'cat'})
+            finally:
+                metrics.slow_request = 0
+                self.app.config['WTF_CSRF_ENABLED'] = True
+            self.assertTrue(any('Slow request: POST /login' in line and
+                                'FROM user' in line for line in logs.output))
+            text = client.get('/metrics').get_data(as_text=True)
+            self.assertNotIn('microblog_request_sql_statements_bucket{'
+                'endpoint="auth.login",method="POST",le="0"} 1', text)
+            self.assertIn('microblog_request_sql_statements_count{'
+                'endpoint="auth.login",method="POST"} 1', text)
+
+        def test_log_pipeline(self):
+            with tempfile.TemporaryDirectory() as tmp:
+                self.app.config['LOG_DIR'] = tmp
+                pipeline = LogPipeline(self.app)
+                try:
+                    with self.app.test_request_context('/user/john?x=1'):
+                        try:
+                            1 / 0
+                        except ZeroDivisionError:
+                            self.app.logger.exception('Failed for %s', 'john')
+                finally:
+                    pipeline.stop()
+                    self.app.logger.removeHandler(pipeline.handler)
+                with open(os.path.join(tmp, 'microblog.log')) as f:
+                    entry = json.loads(f.readline())
+            self.assertEqual(entry['level'], 'ERROR')
+            self.assertEqual(entry['message'], 'Failed for john')
+            self.assertEqual(entry['request']['path'], '/user/john?x=1')
+            self.assertIn('ZeroDivisionError', entry['exception'])
+
+            # a full queue drops records instead of blocking
+            handler = DropQueueHandler(Queue(maxsize=1))
+            logger = logging.getLogger('test_log_pipeline')
+            logger.addHandler(handler)
+            logger.propagate = False
+            logger.warning('one')
+            logger.warning('two')
+            self.assertEqual(handler.dropped, 1)
+
+            # the queued copy doesn't strip the record other handlers get
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                record = logger.makeRecord(logger.name, logging.ERROR, 'f', 1,
+                    'Failed for %s', ('john',), sys.exc_info())
+            queued = handler.prepare(record)
+            self.assertEqual((queued.msg, queued.exc_info),
+                             ('Failed for john', None))
+            self.assertEqual(record.args, ('john',))
+            self.assertIsNotNone(record.exc_info)
 
+            class RecordingHandler(RateLimitedSMTPHandler):
+                def send(self, record):
+                    sent.append(self.format(record))
+            sent = []
+            mailer = RecordingHandler('localhost', 'a@example.com',
+                                      ['b@example.com'], 'Failure', interval=60)
+            logger.handlers = [mailer]
+            def fail(i):
+                logger.error('same error %d', i)
+            for i in range(5):
+                fail(i)
+            logger.error('another error')
+            self.assertEqual(len(sent), 2)
+            self.assertEqual(mailer.suppressed, 4)
+            mailer._last_sent.clear() # as if the interval had passed
+            fail(5)
+            self.assertEqual(len(sent), 3)
+            self.assertIn('4 more like this', sent[-1])
 
 
 if __name__ == '__main__':